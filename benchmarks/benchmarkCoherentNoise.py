@@ -0,0 +1,88 @@
+"""
+Compare the vectorized removeCoherentNoise with the original group by group implementation on synthetic events,
+checking that both give the same results. The check is repeated with a channel count which is not a multiple of the
+grouping so the partial last group is covered too.
+
+usage: python benchmarks/benchmarkCoherentNoise.py [--events N] [--channels N] [--ticks N] [--grouping N] [--repeat N]
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+# Allow running from a checkout without installing anything
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sigproc_tools.sigproc_functions.noiseProcessing import getPedestalsAndRMS,getMedianNoiseCorrection,removeCoherentNoise
+from syntheticEvents import SyntheticEventsFolder
+
+def removeCoherentNoiseReference(waveforms,grouping,nTicks):
+    """
+    The original implementation, looping over groups and growing the outputs with np.concatenate
+    """
+    nChannels = waveforms.shape[0]
+
+    for idx in range(0,nChannels,grouping):
+        temp,tempMed,tempRMS = getMedianNoiseCorrection(waveforms[idx:idx+grouping,:])
+        if idx == 0:
+            waveLessCoherent = temp
+            median           = tempMed
+            intrinsicRMS     = tempRMS
+        else:
+            waveLessCoherent = np.concatenate((waveLessCoherent,temp),axis=0)
+            median           = np.concatenate((median,tempMed),axis=0)
+            intrinsicRMS     = np.concatenate((intrinsicRMS,tempRMS),axis=0)
+
+    # A partial last group adds one more row
+    median       = median.reshape(-1,nTicks)
+    intrinsicRMS = intrinsicRMS.reshape(-1,nTicks)
+
+    return waveLessCoherent,median,intrinsicRMS
+
+def timeIt(func,repeat):
+    times = []
+    for idx in range(repeat):
+        startTime = time.perf_counter()
+        result    = func()
+        times.append(time.perf_counter() - startTime)
+    return min(times),result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events",  type=int,default=4)
+    parser.add_argument("--channels",type=int,default=576)
+    parser.add_argument("--ticks",   type=int,default=4096)
+    parser.add_argument("--grouping",type=int,default=64)
+    parser.add_argument("--repeat",  type=int,default=3)
+    args = parser.parse_args()
+
+    eventsFolder = SyntheticEventsFolder(args.events,args.channels,args.ticks,args.grouping)
+    waveLessPed  = np.stack([getPedestalsAndRMS(eventsFolder.getEventWaveforms(eventNum))[0] for eventNum in range(args.events)])
+
+    refTime,refResult = timeIt(lambda: [removeCoherentNoiseReference(event,args.grouping,args.ticks) for event in waveLessPed],args.repeat)
+    vecTime,vecResult = timeIt(lambda: [removeCoherentNoise(event,args.grouping,args.ticks) for event in waveLessPed],args.repeat)
+    stkTime,stkResult = timeIt(lambda: removeCoherentNoise(waveLessPed,args.grouping),args.repeat)
+
+    for eventNum in range(args.events):
+        for refArray,vecArray,stkArray in zip(refResult[eventNum],vecResult[eventNum],stkResult):
+            if not (np.allclose(refArray,vecArray) and np.allclose(refArray,stkArray[eventNum])):
+                raise RuntimeError("Vectorized removeCoherentNoise differs from the reference for event %d" % eventNum)
+
+    # The partial last group, dropping channels if the events hold a whole number of groups
+    nChannels = args.channels - args.grouping // 2 if args.channels % args.grouping == 0 else args.channels
+    partial   = waveLessPed[0,:nChannels]
+    for refArray,vecArray in zip(removeCoherentNoiseReference(partial,args.grouping,args.ticks),removeCoherentNoise(partial,args.grouping)):
+        if refArray.shape != vecArray.shape or not np.allclose(refArray,vecArray):
+            raise RuntimeError("Vectorized removeCoherentNoise differs from the reference for %d channels" % nChannels)
+
+    print("Events:",args.events,", channels:",args.channels,", ticks:",args.ticks,", grouping:",args.grouping)
+    print("%-28s %10s %10s" % ("implementation","time [s]","speedup"))
+    print("%-28s %10.4f %10.2f" % ("reference (per group)",refTime,1.))
+    print("%-28s %10.4f %10.2f" % ("vectorized (per event)",vecTime,refTime/vecTime))
+    print("%-28s %10.4f %10.2f" % ("vectorized (event stack)",stkTime,refTime/stkTime))
+    print("Results agree, also for",nChannels,"channels (partial last group of",(nChannels-1) % args.grouping + 1,"channels)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Guard the start up cost of the package: each module is imported in a fresh python process (numpy is imported first
+and not counted, every worker needs it) and the import time, best of --repeat, is reported. The numpy only modules are
+also checked not to pull in any of the heavy dependencies (uproot, scipy, plotly, matplotlib). Exits with an error if
+any import is slower than --maxTime or loads a module it should not.
+
+usage: python benchmarks/benchmarkImports.py [--repeat N] [--maxTime seconds] [--modules name ...] [--details N]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Run the imports from the checkout without installing anything
+repoFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+heavyModules = ("uproot","scipy","scipy.stats","scipy.signal","scipy.ndimage","scipy.fft","plotly","matplotlib")
+
+# The module (or "from module import names") to import and the heavy modules it must not load
+importCases = {"sigproc_tools"                                   : heavyModules,
+               "from sigproc_tools import FilterEvents,getPedestalsAndRMS,removeCoherentNoise,findROIs,findHits"
+                                                                 : heavyModules,
+               "sigproc_tools.sigproc_functions.noiseProcessing" : heavyModules,
+               "sigproc_tools.sigproc_functions.noiseAnalysis"   : heavyModules,
+               "sigproc_tools.sigproc_functions.roiFinder"       : heavyModules,
+               "sigproc_tools.sigproc_functions.hitFinder"       : heavyModules,
+               "sigproc_tools.sigproc_functions.fakeParticle"    : heavyModules,
+               "sigproc_tools.sigproc_objects.rawdigit"          : heavyModules,
+               "sigproc_tools.sigproc_objects.filterevents"      : heavyModules,
+               "sigproc_tools.sigproc_objects.fullresponse"      : heavyModules,
+               "sigproc_tools.sigproc_objects.deconvolution"     : heavyModules,
+               "sigproc_tools.sigproc_objects.powerspectrum"     : heavyModules,
+               "sigproc_tools.sigproc_objects.noisestatistics"   : heavyModules,
+               "plotting"                                        : heavyModules}
+
+# Run in the child process: time the import and list which of the heavy modules it loaded
+childScript = """
+import sys,time,json
+import numpy
+startTime = time.perf_counter()
+exec({statement!r})
+elapsed   = time.perf_counter() - startTime
+print(json.dumps({{"time" : elapsed, "loaded" : [name for name in {heavy!r} if name in sys.modules]}}))
+"""
+
+def getStatement(case):
+    return case if case.startswith("from ") else "import "+case
+
+def timeImport(case,repeat):
+    """
+    returns: the best import time of the case over repeat fresh processes and the heavy modules it loaded
+    """
+    script  = childScript.format(statement=getStatement(case),heavy=heavyModules)
+    results = []
+    for idx in range(repeat):
+        output = subprocess.check_output([sys.executable,"-c",script],cwd=repoFolder)
+        results.append(json.loads(output.decode().strip().splitlines()[-1]))
+    return min(result["time"] for result in results),results[0]["loaded"]
+
+def printImportTimes(case,numLines):
+    """
+    Print the slowest modules imported by the case, from python -X importtime (cumulative times)
+    """
+    script = "import numpy\n"+getStatement(case)
+    output = subprocess.run([sys.executable,"-X","importtime","-c",script],cwd=repoFolder,stderr=subprocess.PIPE).stderr.decode()
+
+    entries = []
+    for line in output.splitlines():
+        fields = line.split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            entries.append((int(fields[1]),fields[2].rstrip()))
+
+    # Only what was imported after numpy counts
+    numpyIdx = max((idx for idx,(_,name) in enumerate(entries) if name.strip() == "numpy"),default=-1)
+    for cumulative,name in sorted(entries[numpyIdx+1:],reverse=True)[:numLines]:
+        print("    %10.1f ms  %s" % (cumulative / 1.e3,name))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int,  default=3)
+    parser.add_argument("--maxTime",type=float,default=0.5,help="import time budget in seconds (numpy excluded)")
+    parser.add_argument("--modules",nargs="+", default=list(importCases),choices=list(importCases))
+    parser.add_argument("--details",type=int,  default=0,help="print this many of the slowest imported modules per case")
+    args = parser.parse_args()
+
+    print("%-70s %10s  %s" % ("import","time [ms]","heavy modules loaded"))
+
+    failures = []
+    for case in args.modules:
+        elapsed,loaded = timeImport(case,args.repeat)
+        forbidden      = [name for name in loaded if name in importCases[case]]
+        flag           = " <-- slow" if elapsed > args.maxTime else ""
+        print("%-70s %10.1f  %s%s" % (case,1.e3*elapsed,", ".join(loaded) if loaded else "-",flag))
+        if args.details > 0:
+            printImportTimes(case,args.details)
+        if forbidden or elapsed > args.maxTime:
+            failures.append(case)
+
+    if failures:
+        print("Import checks failed for:",", ".join(failures))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
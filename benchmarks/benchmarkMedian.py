@@ -0,0 +1,62 @@
+"""
+Time the median backends of noiseProcessing.computeMedian against np.median for the two medians used in the noise
+filtering: along ticks (pedestals) and along the channels of a group (coherent noise), checking the results agree.
+
+usage: python benchmarks/benchmarkMedian.py [--channels N] [--ticks N] [--grouping N] [--repeat N]
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+# Allow running from a checkout without installing anything
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sigproc_tools.sigproc_functions.noiseProcessing import computeMedian,medianMethods,getPedestalsAndRMS
+from syntheticEvents import SyntheticEventsFolder
+
+def timeIt(func,repeat):
+    times = []
+    for idx in range(repeat):
+        startTime = time.perf_counter()
+        result    = func()
+        times.append(time.perf_counter() - startTime)
+    return min(times),result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels",type=int,default=576)
+    parser.add_argument("--ticks",   type=int,default=4096)
+    parser.add_argument("--grouping",type=int,default=64)
+    parser.add_argument("--repeat",  type=int,default=5)
+    args = parser.parse_args()
+
+    eventsFolder = SyntheticEventsFolder(1,args.channels,args.ticks,args.grouping)
+    waveforms    = eventsFolder.getEventWaveforms(0)
+    waveLessPed  = getPedestalsAndRMS(waveforms)[0]
+    nFull        = (args.channels // args.grouping) * args.grouping
+    grouped      = waveLessPed[:nFull].reshape(-1,args.grouping,args.ticks)
+
+    # The pedestal subtracted values are multiples of 0.5 (the median of an even number of counts)
+    cases = [("pedestal (int16, ticks)",  waveforms,-1,1.),
+             ("coherent (float, channels)",grouped, -2,0.5)]
+
+    for caseName,data,axis,resolution in cases:
+        refTime,reference = timeIt(lambda: np.median(data,axis=axis),args.repeat)
+
+        print(caseName,", shape:",data.shape)
+        print("   %-12s %10s %10s %12s" % ("method","time [s]","speedup","max |diff|"))
+
+        for method in medianMethods:
+            methodTime,median = timeIt(lambda: computeMedian(data,axis=axis,method=method,resolution=resolution),args.repeat)
+            maxDiff           = np.max(np.abs(median - reference))
+
+            if method != "approximate" and maxDiff != 0.:
+                raise RuntimeError("Median method "+method+" does not reproduce np.median")
+
+            print("   %-12s %10.4f %10.2f %12.3g" % (method,methodTime,refTime/methodTime,maxDiff))
+
+if __name__ == "__main__":
+    main()
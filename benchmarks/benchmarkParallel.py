@@ -0,0 +1,70 @@
+"""
+Compare the event throughput of FilterEvents for different numbers of workers using synthetic events.
+Also checks that every configuration returns events in the same order and with identical results.
+
+usage: python benchmarks/benchmarkParallel.py [--events N] [--channels N] [--ticks N] [--grouping N]
+                                              [--workers 1 2 4 8 16] [--chunk-size N] [--processes]
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+# Allow running from a checkout without installing anything
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sigproc_tools.sigproc_objects.filterevents import FilterEvents
+from syntheticEvents import SyntheticEventsFolder
+
+def runFilter(eventsFolder,grouping,numWorkers,chunkSize,useProcesses):
+    """
+    Run the streaming event loop and return the elapsed time, the ordered event numbers and a checksum per event
+    """
+    filterEvents = FilterEvents(eventsFolder,"raw::RawDigits_daq__TPCANALYSIS.")
+    eventNos     = []
+    checksums    = []
+
+    startTime = time.perf_counter()
+    for eventNo,waveLessPed,pedestals,rms,waveLessCoherent,median,intrinsicRMS in \
+            filterEvents.iterateEvents(grouping,numWorkers=numWorkers,chunkSize=chunkSize,useProcesses=useProcesses):
+        eventNos.append(eventNo)
+        checksums.append((pedestals.sum(),rms.sum(),waveLessCoherent.sum(),intrinsicRMS.sum()))
+    elapsed = time.perf_counter() - startTime
+
+    return elapsed,eventNos,np.array(checksums)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events",    type=int,default=64)
+    parser.add_argument("--channels",  type=int,default=576)
+    parser.add_argument("--ticks",     type=int,default=4096)
+    parser.add_argument("--grouping",  type=int,default=64)
+    parser.add_argument("--workers",   type=int,nargs="+",default=[1,2,4,8,16])
+    parser.add_argument("--chunk-size",type=int,default=2)
+    parser.add_argument("--processes", action="store_true",help="use a process pool instead of a thread pool")
+    args = parser.parse_args()
+
+    eventsFolder = SyntheticEventsFolder(args.events,args.channels,args.ticks,args.grouping)
+    eventMB      = args.channels * args.ticks * 2 / 1.e6
+
+    print("Events:",args.events,", channels:",args.channels,", ticks:",args.ticks,", grouping:",args.grouping,
+          ", pool:","process" if args.processes else "thread",", chunk size:",args.chunk_size)
+    print("%8s %10s %10s %10s %8s" % ("workers","time [s]","events/s","MB/s","speedup"))
+
+    refTime,refEventNos,refChecksums = None,None,None
+
+    for numWorkers in args.workers:
+        elapsed,eventNos,checksums = runFilter(eventsFolder,args.grouping,numWorkers,args.chunk_size,args.processes)
+
+        if refTime is None:
+            refTime,refEventNos,refChecksums = elapsed,eventNos,checksums
+        elif eventNos != refEventNos or not np.array_equal(checksums,refChecksums):
+            raise RuntimeError("Results with %d workers differ from the single worker results" % numWorkers)
+
+        print("%8d %10.3f %10.2f %10.1f %8.2f" % (numWorkers,elapsed,len(eventNos)/elapsed,
+                                                 len(eventNos)*eventMB/elapsed,refTime/elapsed))
+
+if __name__ == "__main__":
+    main()
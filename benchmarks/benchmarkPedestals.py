@@ -0,0 +1,76 @@
+"""
+Time getPedestalsAndRMS and measure its peak memory use (tracemalloc) for the default float64 path, float32 compute
+and an in place subtraction into a reused buffer, checking they agree. Also checks an in place subtraction on the
+(float) waveforms themselves and that integer ADC waveforms are refused as the output buffer.
+
+usage: python benchmarks/benchmarkPedestals.py [--channels N] [--ticks N] [--repeat N]
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+# Allow running from a checkout without installing anything
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sigproc_tools.sigproc_functions.noiseProcessing import getPedestalsAndRMS
+from syntheticEvents import SyntheticEventsFolder
+
+def measure(func,repeat):
+    times = []
+    for idx in range(repeat):
+        startTime = time.perf_counter()
+        result    = func()
+        times.append(time.perf_counter() - startTime)
+
+    tracemalloc.start()
+    func()
+    peakBytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return min(times),peakBytes,result
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels",type=int,default=576)
+    parser.add_argument("--ticks",   type=int,default=4096)
+    parser.add_argument("--repeat",  type=int,default=5)
+    args = parser.parse_args()
+
+    waveforms = SyntheticEventsFolder(1,args.channels,args.ticks).getEventWaveforms(0)
+    buffer32  = np.empty(waveforms.shape,dtype=np.float32)
+
+    cases = [("float64 (default)",   lambda: getPedestalsAndRMS(waveforms)),
+             ("float32",             lambda: getPedestalsAndRMS(waveforms,dtype=np.float32)),
+             ("float32, out buffer", lambda: getPedestalsAndRMS(waveforms,out=buffer32)),
+             ("float32, histogram",  lambda: getPedestalsAndRMS(waveforms,medianMethod="histogram",out=buffer32))]
+
+    _,_,(_,refPedestals,refRMS) = measure(cases[0][1],1)
+
+    print("Waveforms:",waveforms.shape,waveforms.dtype,", size:",waveforms.nbytes/1.e6,"MB")
+    print("%-22s %10s %14s %12s" % ("case","time [s]","peak mem [MB]","max rel diff"))
+
+    for caseName,func in cases:
+        elapsed,peakBytes,(waveLessPed,pedestals,rms) = measure(func,args.repeat)
+        relDiff = np.max(np.abs(rms - refRMS) / refRMS)
+        if not np.array_equal(pedestals,refPedestals) or relDiff > 1.e-4:
+            raise RuntimeError("getPedestalsAndRMS results differ for case "+caseName)
+        print("%-22s %10.4f %14.1f %12.2g" % (caseName,elapsed,peakBytes/1.e6,relDiff))
+
+    # In place on float waveforms must give the same answer, while integer ADC waveforms can't be used as the buffer
+    inPlace = waveforms.astype(np.float32)
+    _,pedestals,rms = getPedestalsAndRMS(inPlace,out=inPlace)
+    if not np.array_equal(pedestals,refPedestals) or np.max(np.abs(rms - refRMS) / refRMS) > 1.e-4:
+        raise RuntimeError("getPedestalsAndRMS results differ for the in place float32 subtraction")
+
+    try:
+        getPedestalsAndRMS(waveforms,out=waveforms.copy())
+        raise RuntimeError("getPedestalsAndRMS accepted an integer ("+str(waveforms.dtype)+") out buffer")
+    except ValueError:
+        print("In place float32 subtraction agrees, integer out buffer rejected")
+
+if __name__ == "__main__":
+    main()
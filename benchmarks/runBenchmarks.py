@@ -0,0 +1,247 @@
+"""
+Benchmark suite over the main signal processing paths, run on synthetic RawDigit-shaped events so no input root files
+are needed. For each case the time per event (best of --repeat passes), the throughput in events/s and MB/s (of int16
+input waveforms) and the peak memory allocated during one event (tracemalloc) are reported. Results can be saved to a
+JSON file and compared to a previous one to spot regressions between versions.
+
+usage: python benchmarks/runBenchmarks.py [--events N] [--channels N] [--ticks N] [--grouping N] [--repeat N]
+                                          [--cases name ...] [--output results.json] [--compare old.json]
+                                          [--tolerance 1.2]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import contextlib
+import platform
+import subprocess
+import tracemalloc
+
+import numpy as np
+import scipy
+
+# Allow running from a checkout without installing anything
+repoFolder = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0,repoFolder)
+
+from sigproc_tools.sigproc_functions.noiseProcessing import getPedestalsAndRMS,removeCoherentNoise,getMorphologicalImages
+from sigproc_tools.sigproc_functions.noiseProcessing import removeCoherentNoiseMorphCollection,removeCoherentNoiseMorphInduction
+from sigproc_tools.sigproc_functions.noiseAnalysis import computeCorrelations,getPowerVec
+from sigproc_tools.sigproc_objects.filterevents import FilterEvents
+from syntheticEvents import SyntheticEventsFolder,syntheticResponseReader
+
+def makeFullResponse(plane=2):
+    """
+    Build a FullResponse from a synthetic field response, the uproot module used by FieldResponse is swapped for the
+    synthetic reader only while the response is constructed
+    """
+    import sigproc_tools.sigproc_objects.fieldresponse as fieldresponse
+    from sigproc_tools.sigproc_objects.fullresponse import FullResponse
+
+    reader = fieldresponse.uproot
+    fieldresponse.uproot = syntheticResponseReader
+    try:
+        return FullResponse("","synthetic_vw0"+str(plane)+".root")
+    finally:
+        fieldresponse.uproot = reader
+
+class BenchmarkData:
+    """
+    The synthetic input shared by the cases: a pool of distinct events which the cases cycle through to reach the
+    requested number of events (so 100 events do not need 100 events worth of memory), and derived inputs computed once
+    """
+    def __init__(self,args):
+        self.args         = args
+        self.eventsFolder = SyntheticEventsFolder(args.events,args.channels,args.ticks,args.grouping)
+        self.poolSize     = min(args.events,args.pool)
+        self.rawPool      = [self.eventsFolder.getEventWaveforms(idx) for idx in range(self.poolSize)]
+        self.pedPool      = [getPedestalsAndRMS(waveforms,dtype=np.float32)[0] for waveforms in self.rawPool]
+        self.medianPool   = np.stack([removeCoherentNoise(waveforms,args.grouping)[1] for waveforms in self.pedPool])
+
+    def raw(self,eventIdx):
+        return self.rawPool[eventIdx % self.poolSize]
+
+    def pedestalSubtracted(self,eventIdx):
+        return self.pedPool[eventIdx % self.poolSize]
+
+    def medians(self,numEvents):
+        return self.medianPool[np.arange(numEvents) % self.poolSize]
+
+# Each case returns a function running one event (taking the event index) and the number of input bytes per event
+def caseGetPedestalsAndRMS(data):
+    return (lambda idx: getPedestalsAndRMS(data.raw(idx))),data.raw(0).nbytes
+
+def caseRemoveCoherentNoise(data):
+    return (lambda idx: removeCoherentNoise(data.pedestalSubtracted(idx),data.args.grouping)),data.raw(0).nbytes
+
+def caseMorphCollection(data):
+    return (lambda idx: removeCoherentNoiseMorphCollection(data.pedestalSubtracted(idx),data.args.grouping,data.args.ticks)),data.raw(0).nbytes
+
+def caseMorphInduction(data):
+    return (lambda idx: removeCoherentNoiseMorphInduction(data.pedestalSubtracted(idx),data.args.grouping,data.args.ticks)),data.raw(0).nbytes
+
+def caseMorphShared(data):
+    # Both removers sharing a single set of morphological images
+    def run(idx):
+        waveforms  = data.pedestalSubtracted(idx)
+        morphology = getMorphologicalImages(waveforms,data.args.grouping)
+        removeCoherentNoiseMorphCollection(waveforms,data.args.grouping,data.args.ticks,morphology=morphology)
+        return removeCoherentNoiseMorphInduction(waveforms,data.args.grouping,data.args.ticks,morphology=morphology)
+    return run,data.raw(0).nbytes
+
+def caseCreateParticleTrajectory(data):
+    from sigproc_tools.sigproc_functions.fakeParticle import createParticleTrajectory
+    fullResponse = makeFullResponse(2)
+    shape        = (data.args.channels,data.args.ticks)
+    trackWires   = (10,data.args.channels-10)
+    trackTicks   = (500,data.args.ticks-500)
+    return (lambda idx: createParticleTrajectory(fullResponse,16000.,trackWires,trackTicks,shape)),data.raw(0).nbytes
+
+def caseFullResponse(data):
+    return (lambda idx: makeFullResponse(idx % 3)),0
+
+def caseComputeCorrelations(data):
+    # One "event" is the correlation matrix of the group medians of a single event
+    return (lambda idx: computeCorrelations(data.medians(1))),data.medianPool[0].nbytes
+
+def caseGetPowerVec(data):
+    return (lambda idx: getPowerVec(data.pedestalSubtracted(idx),1. / 0.4)),data.raw(0).nbytes
+
+def caseFilterEvents(data):
+    # The full event loop, reading through RawDigit from the synthetic events folder
+    filterEvents = FilterEvents(data.eventsFolder,"raw:")
+    def run(idx):
+        for result in filterEvents.iterateEvents(data.args.grouping,[idx]):
+            pass
+        return result
+    return run,data.raw(0).nbytes
+
+benchmarkCases = {"getPedestalsAndRMS"                 : caseGetPedestalsAndRMS,
+                  "removeCoherentNoise"                : caseRemoveCoherentNoise,
+                  "removeCoherentNoiseMorphCollection" : caseMorphCollection,
+                  "removeCoherentNoiseMorphInduction"  : caseMorphInduction,
+                  "morphBothSharedImages"              : caseMorphShared,
+                  "createParticleTrajectory"           : caseCreateParticleTrajectory,
+                  "FullResponse"                       : caseFullResponse,
+                  "computeCorrelations"                : caseComputeCorrelations,
+                  "getPowerVec"                        : caseGetPowerVec,
+                  "FilterEvents.iterateEvents"         : caseFilterEvents}
+
+def runCase(name,data,numEvents,repeat):
+    """
+    Time a case over numEvents events, best of repeat passes, then measure the peak memory of a single event
+    """
+    # The progress printout of the code being timed is discarded
+    with open(os.devnull,"w") as devnull, contextlib.redirect_stdout(devnull):
+        runEvent,eventBytes = benchmarkCases[name](data)
+
+        times = []
+        for passIdx in range(repeat):
+            startTime = time.perf_counter()
+            for eventIdx in range(numEvents):
+                runEvent(eventIdx)
+            times.append(time.perf_counter() - startTime)
+
+        tracemalloc.start()
+        runEvent(0)
+        peakBytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    elapsed = min(times)
+    return {"name"          : name,
+            "numEvents"     : numEvents,
+            "timeTotal"     : elapsed,
+            "timePerEvent"  : elapsed / numEvents,
+            "eventsPerSec"  : numEvents / elapsed,
+            "MBPerSec"      : numEvents * eventBytes / 1.e6 / elapsed,
+            "peakMemoryMB"  : peakBytes / 1.e6}
+
+def getEnvironment():
+    try:
+        commit = subprocess.check_output(["git","rev-parse","--short","HEAD"],cwd=repoFolder,stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError,subprocess.CalledProcessError):
+        commit = ""
+
+    return {"date"     : datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit"   : commit,
+            "python"   : platform.python_version(),
+            "numpy"    : np.__version__,
+            "scipy"    : scipy.__version__,
+            "machine"  : platform.machine(),
+            "platform" : platform.platform(),
+            "cpuCount" : os.cpu_count()}
+
+def compareResults(results,oldResults,tolerance):
+    """
+    Print the ratio of the time per event to that of a previous run, returns the names of the cases slower by more
+    than the tolerance
+    """
+    oldCases    = {result["name"] : result for result in oldResults["results"]}
+    regressions = []
+
+    print("\nComparison with",oldResults["environment"].get("commit",""),oldResults["environment"].get("date",""))
+    print("%-36s %12s %12s %8s" % ("case","old [ms]","new [ms]","ratio"))
+
+    for result in results:
+        if result["name"] not in oldCases:
+            continue
+        oldTime = oldCases[result["name"]]["timePerEvent"]
+        ratio   = result["timePerEvent"] / oldTime
+        flag    = " <-- slower" if ratio > tolerance else ""
+        print("%-36s %12.2f %12.2f %8.2f%s" % (result["name"],1.e3*oldTime,1.e3*result["timePerEvent"],ratio,flag))
+        if ratio > tolerance:
+            regressions.append(result["name"])
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events",   type=int,default=10)
+    parser.add_argument("--channels", type=int,default=576)
+    parser.add_argument("--ticks",    type=int,default=4096)
+    parser.add_argument("--grouping", type=int,default=64)
+    parser.add_argument("--pool",     type=int,default=4,help="number of distinct synthetic events cycled through")
+    parser.add_argument("--repeat",   type=int,default=3)
+    parser.add_argument("--cases",    nargs="+",default=list(benchmarkCases),choices=list(benchmarkCases))
+    parser.add_argument("--output",   help="JSON file to save the results to")
+    parser.add_argument("--compare",  help="JSON file of a previous run to compare to")
+    parser.add_argument("--tolerance",type=float,default=1.2,help="time ratio above which a case is flagged as slower")
+    args = parser.parse_args()
+
+    print("Synthetic events:",args.events,"x",args.channels,"channels x",args.ticks,"ticks, grouping",args.grouping)
+    data = BenchmarkData(args)
+
+    print("%-36s %10s %10s %10s %12s" % ("case","ms/event","events/s","MB/s","peak mem [MB]"))
+
+    results = []
+    for name in args.cases:
+        # The per event cost of building the response does not depend on the number of events, a few are enough
+        numEvents = min(args.events,3) if name == "FullResponse" else args.events
+        try:
+            result = runCase(name,data,numEvents,args.repeat)
+        except ImportError as error:
+            print("%-36s skipped (%s)" % (name,error))
+            continue
+        results.append(result)
+        print("%-36s %10.2f %10.1f %10.1f %12.1f" % (name,1.e3*result["timePerEvent"],result["eventsPerSec"],result["MBPerSec"],result["peakMemoryMB"]))
+
+    output = {"environment" : getEnvironment(),
+              "parameters"  : vars(args),
+              "results"     : results}
+
+    if args.output:
+        with open(args.output,"w") as outputFile:
+            json.dump(output,outputFile,indent=2)
+        print("Results saved to",args.output)
+
+    if args.compare:
+        with open(args.compare) as compareFile:
+            regressions = compareResults(results,json.load(compareFile),args.tolerance)
+        if regressions:
+            print("Slower than the previous run:",", ".join(regressions))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# numpy is the source of all life in python
+import numpy as np
+
+# A local stand-in for the uproot "events" folder of an art root file, used to run the benchmarks offline
+
+class SyntheticEventsFolder:
+    """
+    SyntheticEventsFolder: emulates the small part of the uproot events folder interface used by RawDigit, namely
+    folder.array(branchName,entrystart,entrystop,flatten). Waveforms are generated on demand from a seed per event
+    (gaussian noise around a pedestal plus a component coherent across groups of channels), so the object is cheap
+    to pickle and every event is reproducible. The fADC branch mimics the flattened layout seen in the data files,
+    where each waveform is followed by a guard (0) and the count of the next waveform.
+    """
+    def __init__(self,numEvents=10,numChannels=576,numTicks=4096,grouping=64,pedestal=2048.,rms=3.,coherentRMS=2.,seed=1234):
+        """
+        args: numEvents, numChannels, numTicks - the size of the fake data set
+              grouping    - the number of channels sharing the same coherent noise
+              pedestal    - the mean pedestal (each channel gets a small random offset)
+              rms         - the rms of the incoherent noise
+              coherentRMS - the rms of the noise shared within a group of channels
+              seed        - the base seed, event N is generated with seed + N
+        """
+        self.numEventsInFile = numEvents
+        self.numChannels     = numChannels
+        self.numTicks        = numTicks
+        self.grouping        = grouping
+        self.pedestal        = pedestal
+        self.rms             = rms
+        self.coherentRMS     = coherentRMS
+        self.seed            = seed
+
+    def getEventWaveforms(self,eventNum):
+        """
+        Returns the (numChannels,numTicks) int16 waveforms for a given event
+        """
+        rng       = np.random.default_rng(self.seed + eventNum)
+        nGroups   = -(-self.numChannels // self.grouping)
+        pedestals = self.pedestal + rng.normal(0.,5.,size=(self.numChannels,1))
+        coherent  = rng.normal(0.,self.coherentRMS,size=(nGroups,1,self.numTicks))
+        coherent  = np.broadcast_to(coherent,(nGroups,self.grouping,self.numTicks)).reshape(-1,self.numTicks)
+        waveforms = pedestals + coherent[:self.numChannels] + rng.normal(0.,self.rms,size=(self.numChannels,self.numTicks))
+        return np.rint(waveforms).astype(np.int16)
+
+    def getEventADC(self,eventNum):
+        """
+        Returns the flattened fADC array for a given event in the layout found in the data files
+        """
+        adc = np.empty((self.numChannels,self.numTicks+2),dtype=np.int16)
+        adc[:,:-2] = self.getEventWaveforms(eventNum)
+        adc[:,-2]  = 0
+        adc[:,-1]  = self.numTicks
+        return adc.reshape(-1)[:-2]
+
+    def array(self,branchName,entrystart=None,entrystop=None,flatten=False):
+        """
+        Emulates the uproot TTree.array call for the RawDigit branches
+        """
+        entrystart = 0 if entrystart is None else entrystart
+        entrystop  = self.numEventsInFile if entrystop is None else min(entrystop,self.numEventsInFile)
+        eventNums  = range(entrystart,entrystop)
+
+        if branchName.endswith("obj.fADC"):
+            entries = [self.getEventADC(eventNum) for eventNum in eventNums]
+        elif branchName.endswith("obj.fSamples"):
+            entries = [np.full(self.numChannels,self.numTicks,dtype=np.uint64) for eventNum in eventNums]
+        elif branchName.endswith("obj.fChannel"):
+            entries = [np.arange(self.numChannels,dtype=np.uint32) for eventNum in eventNums]
+        elif branchName.endswith("obj"):
+            return np.full(len(eventNums),self.numChannels,dtype=np.int64)
+        else:
+            raise KeyError(branchName)
+
+        if flatten:
+            return np.concatenate(entries) if entries else np.zeros(0)
+
+        return entries
+
+# A local stand-in for the field response root files read by FieldResponse, used to build a FullResponse offline
+
+class SyntheticResponseFile:
+    """
+    SyntheticResponseFile: emulates an uproot file holding a single field response TH1F, in 50 ns bins over 50 us as
+    for the real responses. The plane type is taken from the "vw0N" part of the file name as FieldResponse does: a
+    unipolar pulse for collection (2) and a bipolar pulse for the induction planes (0,1). To build a FullResponse
+    without any root file, replace the uproot module used by fieldresponse.py with "syntheticResponseReader".
+    """
+    def __init__(self,fileName,numBins=1000,binSize=0.05):
+        self.fileName     = fileName
+        self.responseType = int(fileName[fileName.index('vw0')+3])
+        self.timeBins     = np.arange(numBins+1) * binSize
+        times             = self.timeBins[:-1]
+
+        if self.responseType < 2:
+            self.responseVals = -(times - 20.) * np.exp(-0.5 * ((times - 20.) / 1.)**2)
+        else:
+            self.responseVals = np.exp(-0.5 * ((times - 20.) / 1.)**2)
+
+    def keys(self):
+        return [b"fieldResponse;1"]
+
+    def __getitem__(self,name):
+        return self
+
+    def numpy(self):
+        return self.responseVals.copy(),self.timeBins
+
+class syntheticResponseReader:
+    # Provides the uproot.open call used by FieldResponse
+    open = SyntheticResponseFile
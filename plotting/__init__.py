@@ -1,10 +1,11 @@
 # Life cannot exist without numpy
 import numpy as np
 
-# We are not directly using matplotlib but it is still useful for quick checking plots
-import matplotlib.pyplot as plt
+from sigproc_tools.lazyimport import lazyModule
 
+# We are not directly using matplotlib but it is still useful for quick checking plots
+plt = lazyModule("matplotlib.pyplot")
 
-# We will use plot-ly heavily for our graphics
-import plotly.graph_objects as go
-import plotly.subplots as subplots
\ No newline at end of file
+# We will use plot-ly heavily for our graphics, imported when first used (or with plotting.graphs)
+go       = lazyModule("plotly.graph_objects")
+subplots = lazyModule("plotly.subplots")
@@ -1,20 +1,71 @@
 
+# Life cannot exist without numpy
+import numpy as np
+
 # We will use plot-ly heavily for our graphics
 import plotly.graph_objects as go
 import plotly.subplots as subplots
 
+from plotting.levelOfDetail import buildImagePyramid,getLODWindow,quantizeImage
+
 # Define some useful interactive 3D plotting
 # Note that this can be very memory intensive!!
 #
 # Also note that the plotting package we aer using is is plot-ly
 #
+# Both displays can be run in a level of detail (LOD) mode to tame this: set lod=True and the
+# waveforms are binned down to (at most) maxShape = (channels,ticks) with "method" ("maxabs" or
+# "mean") and, optionally, quantized ("float16" or "uint8") before being handed to plot-ly. If
+# ipywidgets is available the figure is returned as a FigureWidget which rebins the visible
+# window at higher resolution each time the view is zoomed (see levelOfDetail.py)
+def makeEventHeatmap(waveforms,lod=False,maxShape=(900,800),method="maxabs",quantize=None):
+    """
+    Returns the Heatmap trace for the event displays and, in LOD mode, a function to rebin it for a new view
+    """
+    if not lod:
+        return go.Heatmap(z=waveforms, colorscale="Greys"),None
+
+    pyramid = buildImagePyramid(waveforms,maxShape,method)
+
+    # Keep the same colour scale for every view when quantizing to uint8
+    zMax   = float(np.max(np.abs(waveforms)))
+    zRange = (-zMax,zMax) if np.min(waveforms) < 0 else (0.,zMax)
+
+    def getView(channelRange=None,tickRange=None):
+        image,channels,ticks = getLODWindow(pyramid,channelRange,tickRange,maxShape,method)
+        image,extraArgs      = quantizeImage(image,quantize,zRange)
+        return dict(z=image,x=ticks,y=channels,**extraArgs)
+
+    return go.Heatmap(colorscale="Greys",**getView()),getView
+
+def addLODZoom(fig,getView):
+    """
+    Turn a figure into a FigureWidget whose (first) trace is rebinned whenever the axes ranges change, the figure is
+    returned unchanged if ipywidgets is not available
+    """
+    if getView is None:
+        return fig
+
+    try:
+        widget = go.FigureWidget(fig)
+    except ImportError:
+        return fig
+
+    def onZoom(layout,tickRange,channelRange):
+        with widget.batch_update():
+            widget.data[0].update(**getView(channelRange,tickRange))
+
+    widget.layout.on_change(onZoom,"xaxis.range","yaxis.range")
+    return widget
+
 # In the first we define simply a heat map stuly event display
-def plotEventView2D(waveforms):
+def plotEventView2D(waveforms,lod=False,maxShape=(900,800),method="maxabs",quantize=None):
     # Create figure
     fig = go.Figure()
     
     # Add surface trace
-    fig.add_trace(go.Heatmap(z=waveforms, colorscale="Greys"))
+    heatmap,getView = makeEventHeatmap(waveforms,lod,maxShape,method,quantize)
+    fig.add_trace(heatmap)
     
     # Update plot sizing
     fig.update_layout(
@@ -122,15 +173,16 @@ def plotEventView2D(waveforms):
     
     #fig.show()
     
-    return fig
+    return addLODZoom(fig,getView)
 
 
 
 # This is a more fancy 3D rendering of an event display
-def plotEventView3D(waveforms):
+def plotEventView3D(waveforms,lod=False,maxShape=(900,800),method="maxabs",quantize=None):
     particleFig = go.Figure()
     
-    particleFig.add_trace(go.Heatmap(z=waveforms, colorscale="Greys"))
+    heatmap,getView = makeEventHeatmap(waveforms,lod,maxShape,method,quantize)
+    particleFig.add_trace(heatmap)
     
     
     # Update plot sizing
@@ -220,6 +272,6 @@ def plotEventView3D(waveforms):
     
     #particleFig.show()
 
-    return particleFig
+    return addLODZoom(particleFig,getView)
 
 
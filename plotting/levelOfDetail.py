@@ -0,0 +1,119 @@
+# Life cannot exist without numpy
+import numpy as np
+
+# Level of detail (LOD) support for the event displays
+#
+# A full (nChannels,nTicks) event has far more pixels than a screen, so rather than handing
+# plot-ly the full array we bin it down to (at most) the size of the plot. The image is binned
+# with either the sample of largest magnitude in each bin ("maxabs", so narrow pulses are never
+# washed out) or the bin mean ("mean"). A pyramid of successively coarser images is built once
+# and the visible window is rebinned from the finest level needed each time the view is zoomed.
+
+lodMethods = ("maxabs","mean")
+
+def binImage(image,channelBin,tickBin,method="maxabs"):
+    """
+    Bin a (nChannels,nTicks) image into blocks of channelBin x tickBin, partial blocks at the edges are kept
+    args: method - "maxabs" keeps the (signed) value of largest magnitude in each block, "mean" the block mean
+    """
+    if channelBin == 1 and tickBin == 1:
+        return image
+
+    nChannels,nTicks = image.shape
+    nChannelBins     = -(-nChannels // channelBin)
+    nTickBins        = -(-nTicks // tickBin)
+    padded           = np.zeros((nChannelBins*channelBin,nTickBins*tickBin),dtype=image.dtype)
+    padded[:nChannels,:nTicks] = image
+    blocks           = padded.reshape(nChannelBins,channelBin,nTickBins,tickBin)
+
+    if method == "maxabs":
+        maxVals = blocks.max(axis=(1,3))
+        minVals = blocks.min(axis=(1,3))
+        return np.where(-minVals > maxVals,minVals,maxVals)
+    elif method == "mean":
+        # The zero padding is excluded by dividing by the number of real entries in each block
+        channelCounts = np.minimum(channelBin,nChannels - np.arange(nChannelBins) * channelBin)
+        tickCounts    = np.minimum(tickBin,nTicks - np.arange(nTickBins) * tickBin)
+        return blocks.sum(axis=(1,3),dtype=np.float64) / np.outer(channelCounts,tickCounts)
+
+    raise ValueError("Unknown LOD method "+str(method)+", choose one of "+str(lodMethods))
+
+def buildImagePyramid(image,maxShape=(900,800),method="maxabs"):
+    """
+    Build the LOD pyramid of an image: a list of (image,channelFactor,tickFactor) starting with the full image, each
+    level halving every axis which is still larger than maxShape (channels,ticks) until the last level fits
+    """
+    image   = np.asarray(image)
+    pyramid = [(image,1,1)]
+
+    while True:
+        level,channelFactor,tickFactor = pyramid[-1]
+        channelBin = 2 if level.shape[0] > maxShape[0] else 1
+        tickBin    = 2 if level.shape[1] > maxShape[1] else 1
+        if channelBin == 1 and tickBin == 1:
+            return pyramid
+        pyramid.append((binImage(level,channelBin,tickBin,method),channelFactor*channelBin,tickFactor*tickBin))
+
+def getLODWindow(pyramid,channelRange=None,tickRange=None,maxShape=(900,800),method="maxabs"):
+    """
+    Return the window (channelRange,tickRange) of the full image binned to fit in maxShape, taken from the coarsest
+    pyramid level which still has enough resolution
+    args: channelRange, tickRange - (first,last) in channels and ticks, None for the full range
+    returns: the binned image and the channel and tick at the centre of each row and column (for the plot axes)
+    """
+    fullImage            = pyramid[0][0]
+    nChannels,nTicks     = fullImage.shape
+    firstChannel,lastChannel = clipRange(channelRange,nChannels)
+    firstTick,lastTick       = clipRange(tickRange,nTicks)
+
+    # The total binning needed to fit the window on the screen
+    channelBin = max(1,-(-(lastChannel - firstChannel) // maxShape[0]))
+    tickBin    = max(1,-(-(lastTick - firstTick) // maxShape[1]))
+
+    # Use the coarsest level which does not exceed it, then bin the rest of the way
+    level,channelFactor,tickFactor = next(entry for entry in reversed(pyramid) if entry[1] <= channelBin and entry[2] <= tickBin)
+    channelBin = -(-channelBin // channelFactor)
+    tickBin    = -(-tickBin // tickFactor)
+
+    window = level[firstChannel//channelFactor:-(-lastChannel//channelFactor),firstTick//tickFactor:-(-lastTick//tickFactor)]
+    window = binImage(window,channelBin,tickBin,method)
+
+    channelStep = channelFactor * channelBin
+    tickStep    = tickFactor * tickBin
+    channels    = (firstChannel // channelFactor) * channelFactor + channelStep * np.arange(window.shape[0]) + 0.5 * (channelStep - 1)
+    ticks       = (firstTick // tickFactor) * tickFactor + tickStep * np.arange(window.shape[1]) + 0.5 * (tickStep - 1)
+
+    return window,channels,ticks
+
+def clipRange(axisRange,axisLength):
+    # Convert a plot axis range (possibly reversed, fractional or out of bounds) to integer (first,last+1) indices
+    if axisRange is None:
+        return 0,axisLength
+    low,high = sorted(axisRange)
+    return max(0,int(np.floor(low))),min(axisLength,int(np.ceil(high))+1)
+
+def quantizeImage(image,quantize=None,zRange=None):
+    """
+    Reduce the size of the image sent to the browser
+    args: quantize - None (unchanged), "float16" (values rounded to half precision, stored as float32 which the plot-ly
+                     javascript supports) or "uint8" (256 levels spanning zRange)
+          zRange   - (zmin,zmax) for the uint8 scale, defaults to the symmetric range of the image
+    returns: the image and a dictionary of extra Heatmap/Surface arguments (colour range and colour bar labels giving
+             the uint8 levels in the original units)
+    """
+    if quantize is None:
+        return image,{}
+    elif quantize == "float16":
+        return image.astype(np.float16).astype(np.float32),{}
+    elif quantize == "uint8":
+        if zRange is None:
+            zMax   = float(np.max(np.abs(image))) if image.size > 0 else 1.
+            zRange = (-zMax,zMax) if np.min(image) < 0 else (0.,zMax)
+        zMin,zMax = zRange
+        scale     = 255. / max(zMax - zMin,1.e-12)
+        levels    = np.clip(np.rint((image - zMin) * scale),0,255).astype(np.uint8)
+        tickVals  = np.linspace(0,255,5)
+        colorbar  = dict(tickvals=tickVals,ticktext=["%.3g" % (zMin + val / scale) for val in tickVals])
+        return levels,dict(zmin=0,zmax=255,colorbar=colorbar)
+
+    raise ValueError("Unknown quantization "+str(quantize)+", choose None, 'float16' or 'uint8'")
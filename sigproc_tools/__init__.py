@@ -0,0 +1,49 @@
+# The top level sigproc_tools API
+#
+# Nothing is imported here until it is used: "import sigproc_tools" is cheap, and e.g.
+#     from sigproc_tools import FilterEvents,getPedestalsAndRMS
+# only imports the modules defining those names (and numpy). The heavy dependencies (uproot, scipy)
+# are deferred further, to the first call of the functions needing them (see lazyimport.py)
+from sigproc_tools.lazyimport import lazyPackage as _lazyPackage
+
+_submodules = ("sigproc_functions","sigproc_objects","lazyimport")
+
+_functions  = "sigproc_tools.sigproc_functions."
+_objects    = "sigproc_tools.sigproc_objects."
+
+_attributes = {# Reading and filtering events
+               "RawDigit"                           : _objects+"rawdigit",
+               "RawDigitStore"                      : _objects+"rawdigitstore",
+               "convertRawDigits"                   : _objects+"rawdigitstore",
+               "FilterEvents"                       : _objects+"filterevents",
+               # Noise processing and analysis
+               "computeMedian"                      : _functions+"noiseProcessing",
+               "getPedestalsAndRMS"                 : _functions+"noiseProcessing",
+               "removeCoherentNoise"                : _functions+"noiseProcessing",
+               "getMorphologicalImages"             : _functions+"noiseProcessing",
+               "removeCoherentNoiseMorphCollection" : _functions+"noiseProcessing",
+               "removeCoherentNoiseMorphInduction"  : _functions+"noiseProcessing",
+               "computeCorrelations"                : _functions+"noiseAnalysis",
+               "computeLagCorrelations"             : _functions+"noiseAnalysis",
+               "getPowerVec"                        : _functions+"noiseAnalysis",
+               "PowerSpectrumAccumulator"           : _objects+"powerspectrum",
+               "NoiseStatistics"                    : _objects+"noisestatistics",
+               # Responses and deconvolution
+               "FieldResponse"                      : _objects+"fieldresponse",
+               "ElectronicsResponse"                : _objects+"electronicsresponse",
+               "FullResponse"                       : _objects+"fullresponse",
+               "getFullResponse"                    : _objects+"responsecache",
+               "Deconvolver"                        : _objects+"deconvolution",
+               # Regions of interest and hits
+               "RegionsOfInterest"                  : _objects+"regionsofinterest",
+               "findROIs"                           : _functions+"roiFinder",
+               "findHits"                           : _functions+"hitFinder",
+               # Simulation
+               "createParticleTrajectory"           : _functions+"fakeParticle",
+               "genNoiseWaveforms"                  : _functions+"fakeParticle",
+               # Timing and memory instrumentation
+               "instrumentation"                    : _objects+"instrumentation"}
+
+__all__ = list(_attributes)
+
+__getattr__,__dir__ = _lazyPackage(__name__,_submodules,_attributes)
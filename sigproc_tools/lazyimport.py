@@ -0,0 +1,67 @@
+# Only the standard library here, this is imported by everything
+import types
+import importlib
+
+# Deferred imports of the heavy dependencies (uproot, scipy.*)
+#
+#     signal = lazyModule("scipy.signal")
+#
+# behaves like "import scipy.signal as signal" except that the module is only imported the first time
+# one of its attributes is used, so modules which only need numpy for most of their functions start
+# quickly (e.g. in short lived worker processes) and dependencies such as uproot are only required by
+# the code which actually uses them.
+
+class LazyModule(types.ModuleType):
+    """
+    LazyModule: a stand-in for a module which imports the real module on first attribute access
+    """
+    def __init__(self,name):
+        super().__init__(name)
+        self.__dict__["_module"] = None
+
+    def load(self):
+        if self.__dict__["_module"] is None:
+            self.__dict__["_module"] = importlib.import_module(self.__name__)
+        return self.__dict__["_module"]
+
+    def __getattr__(self,attribute):
+        return getattr(self.load(),attribute)
+
+    def __dir__(self):
+        return dir(self.load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not yet loaded"
+        return "<lazy module '"+self.__name__+"' ("+state+")>"
+
+def lazyModule(name):
+    return LazyModule(name)
+
+def lazyPackage(packageName,submodules=(),attributes=None):
+    """
+    Module level __getattr__ and __dir__ (PEP 562) for a package whose submodules, and the names it re-exports from
+    them, are only imported when first used:
+          submodules - names of the submodules, e.g. "filterevents" for packageName.filterevents
+          attributes - dictionary of re-exported name to the (absolute) module defining it
+    usage in a package __init__.py:  __getattr__,__dir__ = lazyPackage(__name__,_submodules,_attributes)
+    with the helper names underscored so they stay out of the package namespace
+    """
+    attributes = attributes if attributes is not None else {}
+
+    def __getattr__(name):
+        if name in attributes:
+            value = getattr(importlib.import_module(attributes[name]),name)
+        elif name in submodules:
+            value = importlib.import_module(packageName+"."+name)
+        else:
+            raise AttributeError("module '"+packageName+"' has no attribute '"+name+"'")
+
+        # Cache in the package so the lookup only happens once
+        setattr(importlib.import_module(packageName),name,value)
+        return value
+
+    def __dir__():
+        public = [name for name in vars(importlib.import_module(packageName)) if not name.startswith("_")]
+        return sorted(set(public) | set(submodules) | set(attributes))
+
+    return __getattr__,__dir__
@@ -0,0 +1,6 @@
+# The function modules are imported on first use, e.g. sigproc_functions.noiseProcessing.getPedestalsAndRMS
+from sigproc_tools.lazyimport import lazyPackage as _lazyPackage
+
+_submodules = ("fakeParticle","hitFinder","noiseAnalysis","noiseProcessing","responseFunctions","roiFinder")
+
+__getattr__,__dir__ = _lazyPackage(__name__,_submodules)
@@ -1,38 +1,143 @@
 # the source of life
 import numpy as np
 import math
-from sigproc_tools.sigproc_objects.fullresponse import FullResponse
+import itertools
+from sigproc_tools.lazyimport import lazyModule
+
+# scipy is imported on first use, the FullResponse objects are passed in by the caller
+sfft = lazyModule("scipy.fft")
+
+# Conversion from electrons to the units of the response functions
+electronicsGain = 67.4  # e-/tick from 0.027 fC/(ADC*us) x 0.4 us/tick x 6242.2 e-/fC
 
 
 def genWhiteNoiseWaveform(fullResponse,rms,shape):
     # This function will return a set of white noise waveforms, both "raw" 
-    # and after convolution with the electronics respponse
-    ticks = np.tile(np.arange(shape[1]),shape[0]).reshape(shape)
-    
-    print("ticks shape:",ticks.shape)
-    
-    # Ok, now produce a "white noise" waveform
+    # and after convolution with the full response (see genNoiseWaveforms for noise with a measured spectrum)
     whiteNoise = np.random.normal(loc=0.,scale=rms,size=shape)
 
-    # FFTs of the two
+    # FFT of the noise
     whiteFFT = np.fft.rfft(whiteNoise)
     
     # convolve
-    whiteResponseFFT = np.multiply(fullResponse.ResponseFFT,whiteFFT) #ElecResponseFFT,whiteFFT)
+    whiteResponseFFT = np.multiply(fullResponse.getResponseFFT(shape[-1]),whiteFFT)
     
     # back to time domain...
-    whiteResponse = no.rint(np.fft.irfft(whiteResponseFFT))
+    whiteResponse = np.rint(np.fft.irfft(whiteResponseFFT,n=shape[-1]))
 
     print("whiteResponse shape",whiteResponse.shape,", whiteNoise shape:",whiteNoise.shape)
     
     return whiteResponse.astype(int),whiteNoise
 
+def getNoiseAmplitudes(powerSpectra,numChannels,grouping,numTicks,maxFrequency):
+    """
+    Convert one sided power spectral densities, as returned by getPowerVec (periodogram with sampling frequency
+    maxFrequency), into the rms of the real and imaginary parts of each rfft coefficient of a waveform of numTicks ticks.
+    powerSpectra is a single spectrum (nFrequencies,), one per channel (numChannels,nFrequencies) or one per group of
+    "grouping" channels (nGroups,nFrequencies); the result always has one row per channel
+    """
+    powerSpectra = np.atleast_2d(np.asarray(powerSpectra,dtype=np.float64))
+    nGroups      = -(-numChannels // grouping) if grouping else 0
+
+    if len(powerSpectra) == 1:
+        powerSpectra = np.broadcast_to(powerSpectra,(numChannels,powerSpectra.shape[-1]))
+    elif len(powerSpectra) == nGroups and len(powerSpectra) != numChannels:
+        powerSpectra = np.repeat(powerSpectra,grouping,axis=0)[:numChannels]
+    elif len(powerSpectra) != numChannels:
+        raise ValueError("Expected 1, "+str(numChannels)+" (channels) or "+str(nGroups)+" (groups) spectra, got "+str(len(powerSpectra)))
+
+    if powerSpectra.shape[-1] != numTicks // 2 + 1:
+        raise ValueError("The spectra have "+str(powerSpectra.shape[-1])+" frequencies, waveforms of "+str(numTicks)+" ticks need "+str(numTicks // 2 + 1))
+
+    # E|X_k|^2 = P_k fs N / 2 for the doubled (interior) bins, shared equally by the real and imaginary parts, while
+    # the DC and Nyquist coefficients are real with E|X_k|^2 = P_k fs N
+    amplitudes           = np.sqrt(powerSpectra * (maxFrequency * numTicks / 4.))
+    amplitudes[:,0]      = np.sqrt(powerSpectra[:,0] * maxFrequency * numTicks)
+    if numTicks % 2 == 0:
+        amplitudes[:,-1] = np.sqrt(powerSpectra[:,-1] * maxFrequency * numTicks)
+
+    return amplitudes
+
+def genNoiseWaveforms(powerSpectra,numEvents=1,numChannels=None,grouping=64,coherentSpectra=None,maxFrequency=2.5,seed=None,firstEvent=0,dtype=np.float32,workers=None):
+    """
+    Synthesize noise events with a given power spectrum in one batched frequency domain operation: every rfft
+    coefficient gets a gaussian random amplitude with the variance given by the spectrum and all the waveforms are
+    transformed back with a single irfft
+    args: powerSpectra    - the spectrum of the noise on each channel, as from getPowerVec (or PowerSpectrumAccumulator):
+                            a single spectrum, one per channel or one per group (see getNoiseAmplitudes)
+          numEvents       - the number of events to generate
+          numChannels     - the number of channels per event, defaults to the number of spectra given
+          grouping        - the number of consecutive channels in a group, for per group spectra and the coherent noise
+          coherentSpectra - optional spectrum (single or per group) of a coherent component: one waveform per group is
+                            generated and added to every channel in the group. For closure tests of removeCoherentNoise
+                            use the "coherent" stage spectra for powerSpectra and the "median" stage spectra here
+          maxFrequency    - the sampling frequency used to compute the spectra (1/tickWidth in MHz)
+          seed            - seed for reproducible noise. Each event has its own random stream, derived from the seed
+                            and its event number (firstEvent+i), so events are identical however they are batched
+          dtype           - the type of the output waveforms
+          workers         - number of threads for the scipy.fft inverse transform
+    returns: noise of shape (numEvents,numChannels,nTicks) and the coherent component per group, of shape
+             (numEvents,nGroups,nTicks) (None if no coherentSpectra)
+    """
+    nFrequencies = np.shape(powerSpectra)[-1]
+    numTicks     = 2 * (nFrequencies - 1)
+    numChannels  = numChannels if numChannels is not None else len(np.atleast_2d(powerSpectra))
+    nGroups      = -(-numChannels // grouping)
+    complexType  = np.result_type(dtype,np.complex64)
+    seed         = seed if seed is not None else np.random.SeedSequence().entropy
+
+    amplitudes = getNoiseAmplitudes(powerSpectra,numChannels,grouping,numTicks,maxFrequency).astype(dtype)
+    nRows      = numChannels
+
+    if coherentSpectra is not None:
+        coherentSpectra = np.atleast_2d(coherentSpectra)
+        coherentSpectra = coherentSpectra if len(coherentSpectra) > 1 else np.broadcast_to(coherentSpectra,(nGroups,nFrequencies))
+        amplitudes      = np.concatenate([amplitudes,getNoiseAmplitudes(coherentSpectra,nGroups,1,numTicks,maxFrequency).astype(dtype)])
+        nRows          += nGroups
+
+    spectra = np.empty((numEvents,nRows,nFrequencies),dtype=complexType)
+
+    for eventIdx in range(numEvents):
+        generator = np.random.default_rng([seed,firstEvent+eventIdx])
+        randoms   = generator.standard_normal((2,nRows,nFrequencies),dtype=np.dtype(dtype))
+        spectra[eventIdx].real = randoms[0]
+        spectra[eventIdx].imag = randoms[1]
+
+    # The DC and Nyquist coefficients are real
+    spectra[...,0].imag = 0.
+    if numTicks % 2 == 0:
+        spectra[...,-1].imag = 0.
+
+    spectra  *= amplitudes
+    waveforms = sfft.irfft(spectra,n=numTicks,axis=-1,workers=workers,overwrite_x=True).astype(dtype,copy=False)
+
+    if coherentSpectra is None:
+        return waveforms,None
+
+    noise    = waveforms[:,:numChannels]
+    coherent = waveforms[:,numChannels:]
+    noise   += np.repeat(coherent,grouping,axis=1)[:,:numChannels]
+
+    return noise,coherent
+
+def generateNoiseEvents(powerSpectra,numEvents,chunkSize=16,seed=None,**kwargs):
+    """
+    Generator version of genNoiseWaveforms producing the events in chunks of chunkSize so any number of events can be
+    streamed, the events are the same as a single call with the same seed would return
+    yields: eventNo,noise,coherent for each event (coherent is None if there is no coherent component)
+    """
+    seed = seed if seed is not None else np.random.SeedSequence().entropy
+
+    for firstEvent in range(0,numEvents,chunkSize):
+        noise,coherent = genNoiseWaveforms(powerSpectra,min(chunkSize,numEvents-firstEvent),seed=seed,firstEvent=firstEvent,**kwargs)
+
+        for idx in range(len(noise)):
+            yield firstEvent+idx,noise[idx],coherent[idx] if coherent is not None else None
+
 def genSpikeWaveform(fullResponse,numElectrons,tick,shape):
     # This function will deposit numElectrons into a location "tick" of a set of waveforms of 
     # shape "shape" and then convolve with the response functions input in fullResponse to 
     # create a set of output waveforms
-    electronicsGain = 67.4  # e-/tick from 0.027 fC/(ADC*us) x 0.4 us/tick x 6242.2 e-/fC
-
     if np.isscalar(shape):
         waveformLen = shape
     else:
@@ -46,7 +151,7 @@ def genSpikeWaveform(fullResponse,numElectrons,tick,shape):
     # Now do the convolution to get a "real" waveform
     inputWaveformFFT = np.fft.rfft(inputWaveform)
 
-    outputWaveformFFT = np.multiply(inputWaveformFFT,fullResponse.ResponseFFT)
+    outputWaveformFFT = np.multiply(inputWaveformFFT,fullResponse.getResponseFFT(waveformLen))
 
     outputWaveform = np.fft.irfft(outputWaveformFFT)
 
@@ -64,15 +169,30 @@ def createParticleTrajectory(fullResponse,numElectrons,trackWireRange,trackTickR
     respones functions. The particle will deposit a number of electrons per wire based on the input 
     "numElectrons" which is number of electrons per mm, starting and ending at the coordinates given 
     by trackWireRange and trackTickRange. The output waveforms will have the shape given by "shape"
+
+    The charge deposits for the full track are first collected into an image of shape "shape", which
+    is then convolved with the response in one go (see depositParticleTrajectory and convolveWithResponse)
+    """
+    chargeImage = np.zeros(shape)
+
+    depositParticleTrajectory(chargeImage,numElectrons,trackWireRange,trackTickRange)
+
+    return convolveWithResponse(fullResponse,chargeImage)
+
+def depositParticleTrajectory(chargeImage,numElectrons,trackWireRange,trackTickRange):
     """
-    # Create an empty waveform array
-    waveforms = np.zeros(shape)
+    Add the charge deposited by a straight track to chargeImage (nWires,nTicks), in units of the response
+    functions (i.e. electrons / electronicsGain). The track deposits "numElectrons" electrons per mm between
+    the (wire,tick) coordinates given by trackWireRange and trackTickRange. For each wire the track is stepped
+    across the ticks it spans and each tick gets the charge for the arc length of its step. The track stops
+    at the first wire where it would leave the tick range. All wires and steps are done at once.
+    """
+    nTicks = chargeImage.shape[-1]
 
     # Some handy constants
     mmPerTick        = 0.64                   # so this is 1.6 mm/us * 0.4 us/tick
     mmPerWire        = 3.                     # so this is 3 mm/wire
     dTdW             = mmPerTick/mmPerWire    # This changes slope calculated in delta ticks / delta wires to unitless
-    deltaWireInTicks = mmPerWire/mmPerTick   # so this is 3 mm / ticks2mm giving us wire spacing in ticks
 
     # Get track slope for setting tick as we step across wires
     tanThetaTW = (trackTickRange[1]-trackTickRange[0]) / (trackWireRange[1]-trackWireRange[0])
@@ -80,54 +200,107 @@ def createParticleTrajectory(fullResponse,numElectrons,trackWireRange,trackTickR
     cosTheta   = 1./math.sqrt(1. + tanTheta*tanTheta)
     sinTheta   = tanTheta * cosTheta
 
-    for wireIdx in range(trackWireRange[0],trackWireRange[1]):
-        # The tricky part about this is that as the track angle becomes closer to the direction of 
-        # the wire you need to spread the charge over more than a single tick... and so we need
-        # to try to calcuate that here...
-        # What is the central tick?
-        #tick = int(round(tanThetaTW * (wireIdx - trackWireRange[0]) + trackTickRange[0]))
-        # Note that convention is to follow the track by increasing wire number
-        tickIn  = tanThetaTW * (wireIdx - trackWireRange[0] - 0.5) + trackTickRange[0]
-        tickOut = tanThetaTW * (wireIdx - trackWireRange[0] + 0.5) + trackTickRange[0]
-
-        # Watch for out of bounds conditions
-        if tickIn < 0 or tickIn > 4095 or tickOut < 0 or tickOut > 4095:
-            break;
-
-        # First let's deetermine the total arclength for a 1 wire gap (-1/2 to +1/2) in mm
-        arcLenInToOut = mmPerWire / cosTheta
-
-        # how many intervening ticks?
-        if tickIn < tickOut:  # equivalent to tanThetaTW > 0
-            interveningTicks = math.floor(tickOut) - math.floor(tickIn)
-        else:
-            interveningTicks = math.floor(tickIn) - math.floor(tickOut)
-
-        # Loop through the steps by the number of intervening wires
-        for stepIdx in range(interveningTicks):
-            # Here we take steps...
-            tick     = math.floor(tickIn)
-            tickNext = math.floor(tickIn+1)
+    # The ticks where the track enters and leaves each wire (+/- half a wire spacing)
+    # Note that convention is to follow the track by increasing wire number
+    wires   = np.arange(trackWireRange[0],trackWireRange[1])
+    tickIn  = tanThetaTW * (wires - trackWireRange[0] - 0.5) + trackTickRange[0]
+    tickOut = tanThetaTW * (wires - trackWireRange[0] + 0.5) + trackTickRange[0]
+
+    # Watch for out of bounds conditions, the track stops at the first wire where it leaves the tick range
+    inRange = (tickIn >= 0) & (tickIn <= nTicks-1) & (tickOut >= 0) & (tickOut <= nTicks-1)
+    if not np.all(inRange):
+        lastWire = np.argmin(inRange)
+        wires,tickIn,tickOut = wires[:lastWire],tickIn[:lastWire],tickOut[:lastWire]
+
+    # The total arclength for a 1 wire gap (-1/2 to +1/2) in mm
+    arcLenInToOut = mmPerWire / cosTheta
+
+    # The track steps tick by tick from the entry to the exit tick of each wire
+    firstTick = np.floor(tickIn).astype(int)
+    lastTick  = np.floor(tickOut).astype(int)
+    numSteps  = np.abs(lastTick - firstTick)
+    direction = np.where(tickIn > tickOut,-1,1)
+
+    stepWire  = np.repeat(wires,numSteps)
+    stepIdx   = np.arange(numSteps.sum()) - np.repeat(np.cumsum(numSteps) - numSteps,numSteps)
+    stepTick  = np.repeat(firstTick,numSteps) + np.repeat(direction,numSteps) * stepIdx
+
+    if len(stepTick) > 0:
+        # The first step goes from the entry point to the next tick boundary, the others are full ticks
+        stepArcLen = np.where(stepIdx == 0,
+                              np.repeat(firstTick + direction - tickIn,numSteps),
+                              np.repeat(direction,numSteps)) * mmPerTick / sinTheta
+        np.add.at(chargeImage,(stepWire,stepTick),numElectrons * stepArcLen / electronicsGain)
+
+    # Now handle the final step, which gets whatever is left of the arc length across the wire
+    if np.any(numSteps > 0):
+        finalArcLen = arcLenInToOut - np.where(numSteps > 0,(lastTick - tickIn) * mmPerTick / sinTheta,0.)
+    else:
+        finalArcLen = np.full(len(wires),arcLenInToOut)
 
-            if tickIn > tickOut:
-                tickNext = math.floor(tickIn-1)
+    np.add.at(chargeImage,(wires,lastTick),numElectrons * finalArcLen / electronicsGain)
 
-            stepArcLen = (tickNext - tickIn) * mmPerTick / sinTheta
-        
-            tempWaveforms,_     = genSpikeWaveform(fullResponse,numElectrons*stepArcLen,tick,shape[-1])
-            waveforms[wireIdx] += tempWaveforms
+    return chargeImage
 
-            tickIn         = tickNext
-            arcLenInToOut -= stepArcLen
- 
-        # Now handle the final step
-        tick   = math.floor(tickOut)
+def convolveWithResponse(fullResponse,chargeImage):
+    """
+    Convolve a charge image (...,nTicks) with the full response, all waveforms in a single batched FFT, and
+    then roll to take into account the T0 offset of the response. Rows with no charge are not transformed.
+    Any number of ticks can be used, the response spectrum for that length is provided by the FullResponse
+    """
+    waveforms = np.zeros(chargeImage.shape)
+    hasCharge = np.any(chargeImage != 0.,axis=-1)
 
-        tempWaveforms,_     = genSpikeWaveform(fullResponse,numElectrons*arcLenInToOut,tick,shape[-1])
-        waveforms[wireIdx] += tempWaveforms
+    # The response handles the T0 offset roll
+    if np.any(hasCharge):
+        waveforms[hasCharge] = fullResponse.convolve(chargeImage[hasCharge])
 
     return waveforms
 
+def generateOverlayEvents(fullResponse,rawdigits,trackParams,eventList=None,dtype=np.float64):
+    """
+    Generator producing fake events by overlaying many tracks onto real events. For each fake event all of its tracks
+    are deposited into a single charge image, convolved once with the response and added to the waveforms of the
+    next real event. Output buffers are reused from one event to the next so memory use does not depend on the number
+    of events generated (copy the yielded arrays if they need to be kept).
+    args: fullResponse - the FullResponse for the plane
+          rawdigits    - the source of the real events: a RawDigit, RawDigitStore or FilterEvents (whose RawDigits are used)
+          trackParams  - one entry per fake event, each an array like of shape (nTracks,5) with the columns
+                         (startWire,endWire,startTick,endTick,numElectrons) with numElectrons in electrons per mm
+          eventList    - the real events to overlay onto, cycled through as needed, defaults to all non empty events
+          dtype        - the type of the output waveforms
+    yields: eventNo,waveforms,signal for each fake event, where eventNo is the real event used, waveforms are the real
+            waveforms plus the overlay and signal is the overlay alone
+    """
+    if hasattr(rawdigits,"getRawDigits"):
+        rawdigits = rawdigits.getRawDigits()
+
+    if eventList is None:
+        eventList = range(rawdigits.numEvents())
+
+    eventList   = [eventNo for eventNo in eventList if rawdigits.numChannels(eventNo) > 0]
+    chargeImage = None
+    waveforms   = None
+
+    for tracks,eventNo in zip(trackParams,itertools.cycle(eventList)):
+        shape = (int(rawdigits.numChannels(eventNo)),int(rawdigits.numTicks(eventNo)))
+
+        if chargeImage is None or chargeImage.shape != shape:
+            chargeImage = np.zeros(shape)
+            waveforms   = np.empty(shape,dtype=dtype)
+        else:
+            chargeImage.fill(0.)
+
+        for startWire,endWire,startTick,endTick,numElectrons in np.reshape(tracks,(-1,5)):
+            depositParticleTrajectory(chargeImage,numElectrons,(int(startWire),int(endWire)),(startTick,endTick))
+
+        signal = convolveWithResponse(fullResponse,chargeImage)
+
+        rawdigits.getWaveforms(eventNo,out=waveforms)
+        np.add(waveforms,signal,out=waveforms,casting="unsafe")
+
+        yield eventNo,waveforms,signal
+
 # Below code is "old" since it does not use the response functions. Left for reference
 # Define model function to be used to fit to the data above:
 def gaussParticle(x, *p):
@@ -147,36 +320,15 @@ def createGaussianParticle(waveforms,trackStartTick,trackAngle,pulseHeight,pulse
           pulseHeight    - pulse height for gaussian charge deposit
           pulseWid       - pulse width for gaussian charge deposit
     """
-    # Start with getting the channel coordinates
-    # We need to find the maximum range for our gaussian shape 
-    maxProjection = 4.*pulseWid/math.sin(trackAngle)
-    lowStartTick  = trackStartTick - maxProjection
-    hiStartTick   = trackStartTick + maxProjection
-
-    # Remember that a tick in ICARUS is 0.4 us, drift velocity is ~1.6 mm/us so one tick is ~0.64 mm
-    # Wire space is 3mm which means the distance between wires is ~4.7 ticks
-    channelCoords = 4.7 * np.arange(waveforms.shape[0]) / math.tan(trackAngle)
-    lowTicks      = channelCoords + lowStartTick
-    hiTicks       = channelCoords + hiStartTick
-    
-    # We should make sure we don't exceed the tick range <== need to think about how to keep things right...
-    #lowTicks = lowTicks[lowTicks>0]
-    
     # Define our gauss parameters
     gaussParams = np.array([pulseHeight,0.,pulseWid])
-    
-    # Directly overlay on top of our input waveforms
-    for wireIdx in range(channelCoords.shape[0]):
-        # Ok, we calculate the gaussian distributed values perpendicular to the trajectory
-        # of the track. If we go +/-4 sigma we are within a tenth of a percent of the area (or something)
-        gaussRange = np.arange(-4.*pulseWid,4.*pulseWid,1.)
-        gaussVals  = gaussParticle(gaussRange,*gaussParams)
-        tickRange  = np.rint(np.arange(lowTicks[wireIdx],hiTicks[wireIdx],1.)).astype(np.int)
-        for tickIdx in range(len(gaussVals)):
-            # The following should work to project the gaussian shape (centered on the wire)
-            # to the ticks along the wire. So, it should stretch the charge deposit.
-            waveforms[wireIdx][tickRange[tickIdx]] += gaussVals[tickIdx]
-    
+
+    # Ok, we calculate the gaussian distributed values perpendicular to the trajectory
+    # of the track. If we go +/-4 sigma we are within a tenth of a percent of the area (or something)
+    gaussRange = np.arange(-4.*pulseWid,4.*pulseWid,1.)
+    gaussVals  = gaussParticle(gaussRange,*gaussParams)
+
+    overlayTrackProfile(waveforms,trackStartTick,trackAngle,pulseWid,gaussVals)
 
 # Use this one for creating a bipolar signal
 def createGaussDerivativeParticle(waveforms,trackStartTick,trackAngle,pulseHeight,pulseWid):
@@ -189,34 +341,36 @@ def createGaussDerivativeParticle(waveforms,trackStartTick,trackAngle,pulseHeigh
           pulseHeight    - pulse height for gaussian charge deposit
           pulseWid       - pulse width for gaussian charge deposit
     """
+    # Define our gauss parameters
+    gaussParams = np.array([pulseHeight,0.,pulseWid])
+
+    gaussRange = np.arange(-4.*pulseWid,4.*pulseWid,1.)
+    gaussVals  = gaussParticle(gaussRange,*gaussParams)
+    gaussDer   = np.gradient(gaussVals,0.15)
+
+    overlayTrackProfile(waveforms,trackStartTick,trackAngle,pulseWid,gaussDer)
+
+def overlayTrackProfile(waveforms,trackStartTick,trackAngle,pulseWid,profile):
+    """
+    Add the same tick "profile" to every wire of waveforms (nChannels x nTicks), starting on each wire at the
+    tick where the straight track trajectory enters the +/- 4 pulseWid window. All wires are done at once with
+    a scatter add, and deposits which would fall outside the tick range are dropped.
+    """
     # Start with getting the channel coordinates
-    # We need to find the maximum range for our gaussian shape 
+    # We need to find the maximum range for our gaussian shape
     maxProjection = 4.*pulseWid/math.sin(trackAngle)
     lowStartTick  = trackStartTick - maxProjection
-    hiStartTick   = trackStartTick + maxProjection
 
     # Remember that a tick in ICARUS is 0.4 us, drift velocity is ~1.6 mm/us so one tick is ~0.64 mm
     # Wire space is 3mm which means the distance between wires is ~4.7 ticks
     channelCoords = 4.7 * np.arange(waveforms.shape[0]) / math.tan(trackAngle)
     lowTicks      = channelCoords + lowStartTick
-    hiTicks       = channelCoords + hiStartTick
-    
-    # We should make sure we don't exceed the tick range <== need to think about how to keep things right...
-    #lowTicks = lowTicks[lowTicks>0]
-    
-    # Define our gauss parameters
-    gaussParams = np.array([pulseHeight,0.,pulseWid])
-    
-    # Directly overlay on top of our input waveforms
-    for wireIdx in range(channelCoords.shape[0]):
-        gaussRange = np.arange(-4.*pulseWid,4.*pulseWid,1.)
-        gaussVals  = gaussParticle(gaussRange,*gaussParams)
-        gaussDer   = np.gradient(gaussVals,0.15)
-        if wireIdx == 110:
-            print("der:",gaussDer[:])
-        tickRange  = np.rint(np.arange(lowTicks[wireIdx],hiTicks[wireIdx],1.)).astype(np.int)
-        for tickIdx in range(len(gaussDer)):
-            waveforms[wireIdx][tickRange[tickIdx]] += gaussDer[tickIdx]
-
 
+    # The following should work to project the profile (centered on the wire) to the ticks
+    # along the wire. So, it should stretch the charge deposit.
+    ticks   = np.rint(lowTicks[:,None] + np.arange(len(profile))).astype(int)
+    wires   = np.broadcast_to(np.arange(waveforms.shape[0])[:,None],ticks.shape)
+    inRange = (ticks >= 0) & (ticks < waveforms.shape[-1])
 
+    # Rounding can map two steps to the same tick so we need an unbuffered add
+    np.add.at(waveforms,(wires[inRange],ticks[inRange]),np.broadcast_to(profile,ticks.shape)[inRange])
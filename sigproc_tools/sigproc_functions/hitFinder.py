@@ -0,0 +1,141 @@
+# Gaussian hit finding on (deconvolved) regions of interest
+# Peaks are found and fit for all ROIs of an event at once, working on the flat
+# sample array of a RegionsOfInterest rather than looping over pulses
+#
+# The fit is the closed form (weighted least squares) parabola fit to the log of
+# the samples around each peak, a gaussian being a parabola in log space
+
+import numpy as np
+
+# The hits returned by findHits
+hitType = np.dtype([("channel",      np.int32),     # channel (row) of the hit
+                    ("roi",          np.int32),     # index of the ROI the hit was found in
+                    ("startTick",    np.int32),     # first tick of the ROI
+                    ("endTick",      np.int32),     # one past the last tick of the ROI
+                    ("peakTick",     np.float32),   # fitted peak time in ticks
+                    ("peakAmplitude",np.float32),   # fitted peak amplitude
+                    ("sigma",        np.float32),   # fitted width in ticks
+                    ("integral",     np.float32),   # area of the fitted gaussian
+                    ("summedADC",    np.float32),   # sum of the ROI samples
+                    ("multiplicity", np.int16),     # number of hits in the ROI
+                    ("fitted",       np.bool_)])    # False if the moments had to be used instead of the fit
+
+def findPeaks(rois,threshold=5.):
+    """
+    Locate the local maxima above threshold in every ROI
+    args: rois      - a RegionsOfInterest, typically of deconvolved waveforms
+          threshold - the minimum peak height
+    returns: the index of each peak in rois.samples and the index of its ROI
+    """
+    samples  = rois.samples
+    roiIdx   = np.repeat(np.arange(rois.numROIs()),rois.getLengths())
+
+    # The neighbours of the first/last sample of a ROI are outside it and never block a peak
+    left       = np.empty(len(samples),dtype=samples.dtype)
+    right      = np.empty(len(samples),dtype=samples.dtype)
+    left[1:]   = samples[:-1]
+    right[:-1] = samples[1:]
+    left[rois.offsets[:-1]]  = -np.inf
+    right[rois.offsets[1:]-1] = -np.inf
+
+    peaks = np.flatnonzero((samples > left) & (samples >= right) & (samples > threshold))
+    return peaks,roiIdx[peaks]
+
+def getPeakWindows(rois,peaks,peakRois,halfWindow=5,fraction=0.1):
+    """
+    Gather the samples around each peak into a (nPeaks,2*halfWindow+1) array. A sample is used in the fit if it is
+    inside the ROI, above "fraction" of the peak and reached from the peak without passing through a minimum (so
+    neighbouring peaks are not pulled into the fit)
+    returns: the windows and the mask of the samples to use
+    """
+    samples = rois.samples
+    offsets = np.arange(-halfWindow,halfWindow+1)
+    indices = peaks[:,None] + offsets
+    inside  = (indices >= rois.offsets[peakRois][:,None]) & (indices < rois.offsets[peakRois+1][:,None])
+    windows = samples[np.clip(indices,0,len(samples)-1)].astype(np.float64)
+    usable  = inside & (windows > fraction * windows[:,halfWindow:halfWindow+1])
+
+    # Walk out from the peak in each direction, stopping at the first unusable or rising sample
+    steps           = np.diff(windows,axis=1)
+    rightOK         = usable[:,halfWindow+1:] & (steps[:,halfWindow:] <= 0)
+    leftOK          = usable[:,:halfWindow][:,::-1] & (steps[:,:halfWindow][:,::-1] >= 0)
+    mask            = np.zeros(windows.shape,dtype=bool)
+    mask[:,halfWindow]    = True
+    mask[:,halfWindow+1:] = np.logical_and.accumulate(rightOK,axis=1)
+    mask[:,:halfWindow]   = np.logical_and.accumulate(leftOK,axis=1)[:,::-1]
+
+    return windows,mask
+
+def fitLogParabolas(windows,mask):
+    """
+    Weighted least squares fit of a parabola to the log of the masked samples of each window, all windows at once.
+    The weights are the samples squared which makes this equivalent to a gaussian fit with constant errors.
+    returns: the peak position (relative to the window centre), sigma and amplitude of each window and a mask of the
+             windows where the fit was good
+    """
+    halfWindow = windows.shape[1] // 2
+    x          = np.arange(-halfWindow,halfWindow+1,dtype=np.float64)
+    weights    = np.where(mask,windows,0.)**2
+    logY       = np.log(np.where(mask,windows,1.))
+
+    xPowers = x[None,:]**np.arange(5)[:,None]                          # (5,nSamples)
+    moments = weights @ xPowers.T                                       # (nHits,5)
+    rhs     = np.einsum("hs,ks->hk",weights * logY,xPowers[:3])         # (nHits,3)
+    normal  = moments[:,[[0,1,2],[1,2,3],[2,3,4]]]                      # (nHits,3,3)
+
+    # Three or more samples are needed for the fit, guard the others with the identity so solve doesn't fail
+    good         = (mask.sum(axis=1) >= 3) & (np.abs(np.linalg.det(normal)) > 1.e-12 * np.abs(moments[:,0])**3)
+    normal[~good] = np.eye(3)
+    a,b,c        = np.linalg.solve(normal,rhs[...,None])[...,0].T
+
+    good  &= c < 0.
+    c      = np.where(good,c,-1.)
+    mean   = -b / (2. * c)
+    sigma  = np.sqrt(-0.5 / c)
+    amp    = np.exp(np.minimum(a - b * b / (4. * c),700.))
+    good  &= np.abs(mean) <= halfWindow
+
+    return mean,sigma,amp,good
+
+def findHits(rois,threshold=5.,halfWindow=5,fraction=0.1):
+    """
+    Find and fit gaussian hits in all the ROIs of an event
+    args: rois       - a RegionsOfInterest, typically of deconvolved waveforms
+          threshold  - the minimum peak height for a hit
+          halfWindow - the fit uses at most halfWindow samples either side of the peak
+          fraction   - samples below this fraction of the peak are not used in the fit
+    returns: a structured array of hitType, one entry per hit ordered by channel and tick. Where the fit fails the
+             mean and rms of the masked samples (and the peak sample) are returned with fitted set to False
+    """
+    peaks,peakRois = findPeaks(rois,threshold)
+    windows,mask   = getPeakWindows(rois,peaks,peakRois,halfWindow,fraction)
+    mean,sigma,amp,good = fitLogParabolas(windows,mask)
+
+    # Moments of the masked samples for the hits which could not be fit
+    if not np.all(good):
+        x          = np.arange(-halfWindow,halfWindow+1,dtype=np.float64)
+        weights    = np.where(mask,windows,0.)
+        sumWeights = weights.sum(axis=1)
+        momMean    = (weights @ x) / sumWeights
+        momSigma   = np.sqrt(np.maximum((weights @ x**2) / sumWeights - momMean**2,1./12.))
+        mean       = np.where(good,mean,momMean)
+        sigma      = np.where(good,sigma,momSigma)
+        amp        = np.where(good,amp,windows[:,halfWindow])
+
+    lengths   = rois.getLengths()
+    summedADC = np.add.reduceat(rois.samples,rois.offsets[:-1]) if rois.numROIs() > 0 else np.zeros(0)
+
+    hits                  = np.zeros(len(peaks),dtype=hitType)
+    hits["channel"]       = rois.channels[peakRois]
+    hits["roi"]           = peakRois
+    hits["startTick"]     = rois.startTicks[peakRois]
+    hits["endTick"]       = rois.startTicks[peakRois] + lengths[peakRois]
+    hits["peakTick"]      = rois.startTicks[peakRois] + (peaks - rois.offsets[peakRois]) + mean
+    hits["peakAmplitude"] = amp
+    hits["sigma"]         = sigma
+    hits["integral"]      = amp * sigma * np.sqrt(2. * np.pi)
+    hits["summedADC"]     = summedADC[peakRois]
+    hits["multiplicity"]  = np.bincount(peakRois,minlength=rois.numROIs())[peakRois]
+    hits["fitted"]        = good
+
+    return hits
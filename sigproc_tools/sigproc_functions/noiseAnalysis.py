@@ -1,46 +1,141 @@
 # the source of life
 import numpy as np
-import scipy.stats as stats
-import scipy.signal as signal
+from sigproc_tools.lazyimport import lazyModule
 
-import math
+# scipy is imported on first use
+signal = lazyModule("scipy.signal")
+sfft   = lazyModule("scipy.fft")
 
 # Provide some of the basic functions for doing analysis of waveforms
 
-def computeCorrelations(waveforms,numEvents,nGroups):
-    # Assume input waveforms have shape [numEvents,nGroups,nTicks]
-    statCorMatrix = np.zeros((nGroups,nGroups))
-    xcorCorMatrix = np.zeros((nGroups,nGroups))
-    
-    print("Computing correlations over",numEvents," events and",nGroups," groups")
-    
-    for eventToCheck in range(numEvents):
-        for outIdx in range(nGroups):
-            # Try to prevent double counting... and the result should be obvious but just in case...
-            stat,pValue = stats.pearsonr(waveforms[eventToCheck,outIdx,:],waveforms[eventToCheck,outIdx,:])
-            statCorMatrix[outIdx,outIdx] += stat    
-            corr    = signal.correlate(waveforms[eventToCheck,outIdx,:],waveforms[eventToCheck,outIdx,:],mode='same') / 4096
-            xCorMax = corr[2048]
-            xcorCorMatrix[outIdx,outIdx] += 1.
-            
-            # Now loop through off diagonal components
-            for inIdx in range(outIdx+1,nGroups,1):
-                stat,pValue = stats.pearsonr(waveforms[eventToCheck,outIdx,:],waveforms[eventToCheck,inIdx,:])
-                statCorMatrix[outIdx,inIdx] += stat
-                statCorMatrix[inIdx,outIdx] += stat
-                corr = signal.correlate(waveforms[eventToCheck,outIdx,:],waveforms[eventToCheck,inIdx,:],mode='same') / 4096
-                xcorCorMatrix[outIdx,inIdx] += corr[2048]/xCorMax
-                xcorCorMatrix[inIdx,outIdx] += corr[2048]/xCorMax
-        
-        if eventToCheck%10 == 0:
-            print("--> Done with event ",eventToCheck)
-    
+def computeCorrelations(waveforms,numEvents=None,nGroups=None,lag=0,chunkSize=16):
+    """
+    Average correlation matrices between waveforms (e.g. the group medians), over events:
+          statCorMatrix - the Pearson correlation coefficients
+          xcorCorMatrix - the cross correlation at "lag" ticks between each pair, relative to the autocorrelation
+                          (at the same lag) of the lower indexed waveform of the pair, with 1 on the diagonal
+    args: waveforms - an array of shape [numEvents,nGroups,nTicks], or any iterable of [nGroups,nTicks] events (e.g. a
+                      generator) which is then consumed one event at a time
+          numEvents - optional number of events to use, defaults to all of them
+          nGroups   - optional number of waveforms (from the first) to correlate, defaults to all of them
+          lag       - the lag in ticks of the cross correlation, waveform i at tick n+lag against waveform j at tick n
+          chunkSize - the number of events of an array handled in one batched matrix product
+    Each event costs two matrix products of its [nGroups,nTicks] waveforms, so there is no loop over pairs
+    """
+    statCorMatrix = None
+    xcorCorMatrix = None
+    eventsSummed  = 0
+
+    for chunk in iterateEventChunks(waveforms,numEvents,chunkSize):
+        chunk = np.asarray(chunk,dtype=np.float64)[:,:nGroups]
+
+        if statCorMatrix is None:
+            nWaveforms    = chunk.shape[1]
+            statCorMatrix = np.zeros((nWaveforms,nWaveforms))
+            xcorCorMatrix = np.zeros((nWaveforms,nWaveforms))
+            print("Computing correlations between",nWaveforms," groups")
+
+        statCorMatrix += getPearsonMatrices(chunk).sum(axis=0)
+        xcorCorMatrix += getCrossCorrelationRatios(getLagProducts(chunk,lag)).sum(axis=0)
+        eventsSummed  += len(chunk)
+
     # Normalize to number of events
-    statCorMatrix /= 100.
-    xcorCorMatrix /= 100.
-    
+    if eventsSummed > 0:
+        statCorMatrix /= eventsSummed
+        xcorCorMatrix /= eventsSummed
+
+    print("--> Done with",eventsSummed," events")
+
     return statCorMatrix,xcorCorMatrix
 
+def computeLagCorrelations(waveforms,lags,numEvents=None,nGroups=None,chunkSize=16,maxMemory=256*1024*1024):
+    """
+    As the cross correlation of computeCorrelations but for a set of lags at once, using one batched FFT per event
+    (zero padded so the correlation is not circular) rather than one matrix product per lag
+    args: lags - a sequence of lags in ticks
+          maxMemory - limit in bytes on the size of the pairwise cross spectra held at any time
+    returns: the average cross correlation ratios, of shape [len(lags),nGroups,nGroups]
+    """
+    lags          = np.asarray(lags,dtype=int)
+    xcorCorMatrix = None
+    eventsSummed  = 0
+
+    for chunk in iterateEventChunks(waveforms,numEvents,chunkSize):
+        chunk = np.asarray(chunk,dtype=np.float64)[:,:nGroups]
+        nWaveforms,nTicks = chunk.shape[1:]
+
+        if xcorCorMatrix is None:
+            xcorCorMatrix = np.zeros((len(lags),nWaveforms,nWaveforms))
+            fftLen        = sfft.next_fast_len(2 * nTicks - 1,real=True)
+            rowBlock      = max(1,int(maxMemory // (16 * nWaveforms * (fftLen // 2 + 1))))
+
+        for event in chunk:
+            spectrum = sfft.rfft(event,n=fftLen,axis=-1)
+            products = np.empty((len(lags),nWaveforms,nWaveforms))
+
+            # Cross spectra of a block of rows against all waveforms, back to the lags of interest
+            for first in range(0,nWaveforms,rowBlock):
+                crossSpectra = spectrum[first:first+rowBlock,None,:] * np.conj(spectrum[None,:,:])
+                correlation  = sfft.irfft(crossSpectra,n=fftLen,axis=-1,overwrite_x=True)
+                products[:,first:first+rowBlock] = np.moveaxis(correlation[...,lags % fftLen],-1,0)
+
+            xcorCorMatrix += getCrossCorrelationRatios(products)
+            eventsSummed  += 1
+
+    if eventsSummed > 0:
+        xcorCorMatrix /= eventsSummed
+
+    return xcorCorMatrix
+
+def iterateEventChunks(waveforms,numEvents=None,chunkSize=16):
+    # Hand back chunks of events from an array, or events one at a time from any other iterable
+    if isinstance(waveforms,np.ndarray):
+        numEvents = len(waveforms) if numEvents is None else min(numEvents,len(waveforms))
+        for first in range(0,numEvents,chunkSize):
+            yield waveforms[first:min(first+chunkSize,numEvents)]
+    else:
+        for eventIdx,event in enumerate(waveforms):
+            if numEvents is not None and eventIdx >= numEvents:
+                break
+            yield np.asarray(event)[None]
+
+def getPearsonMatrices(waveforms):
+    """
+    The Pearson correlation matrix (as np.corrcoef) of each event in a [numEvents,nGroups,nTicks] array, from a single
+    batched matrix product of the mean subtracted, normalized waveforms
+    """
+    centered  = waveforms - waveforms.mean(axis=-1,keepdims=True)
+    with np.errstate(invalid="ignore",divide="ignore"):
+        centered /= np.sqrt(np.einsum("...t,...t->...",centered,centered))[...,None]
+    return np.clip(np.matmul(centered,np.swapaxes(centered,-1,-2)),-1.,1.)
+
+def getLagProducts(waveforms,lag=0):
+    """
+    The (non circular) cross correlation at a single lag of every pair of waveforms in each event:
+          products[...,i,j] = sum_n waveforms[...,i,n+lag] * waveforms[...,j,n]
+    which for a single lag is just a matrix product of shifted views
+    """
+    nTicks = waveforms.shape[-1]
+    if lag >= 0:
+        leading,trailing = waveforms[...,lag:],waveforms[...,:nTicks-lag]
+    else:
+        leading,trailing = waveforms[...,:nTicks+lag],waveforms[...,-lag:]
+    return np.matmul(leading,np.swapaxes(trailing,-1,-2))
+
+def getCrossCorrelationRatios(products):
+    """
+    Convert cross correlation products into the ratios used in computeCorrelations: element (i,j), i<j, is divided by
+    the autocorrelation of i, the lower triangle mirrors the upper and the diagonal is 1
+    """
+    nWaveforms = products.shape[-1]
+    upper      = np.triu(np.ones((nWaveforms,nWaveforms),dtype=bool),k=1)
+    with np.errstate(invalid="ignore",divide="ignore"):
+        ratios = products / np.diagonal(products,axis1=-2,axis2=-1)[...,None]
+    ratios = np.where(upper,ratios,0.)
+    ratios = ratios + np.swapaxes(ratios,-1,-2)
+    ratios[...,np.arange(nWaveforms),np.arange(nWaveforms)] = 1.
+    return ratios
+
 def getPowerVec(waveforms,maxFrequency):
     meanValue = np.mean(waveforms,axis=-1)
     
@@ -5,94 +5,289 @@
 # Assuming input waveforms have last dimension to be the waveforms
 
 import numpy as np
-import scipy.ndimage as ndimage
+from sigproc_tools.lazyimport import lazyModule
 
-def getPedestalsAndRMS(waveforms):
-    pedestals = np.median(waveforms,axis=-1)
-    if pedestals.ndim > 0:
-        waveLessPed = waveforms - pedestals.reshape((pedestals.shape)+(1,))
+# scipy is only needed for the morphological filters
+ndimage = lazyModule("scipy.ndimage")
+
+# The available median backends, see computeMedian
+medianMethods = ("numpy","partition","histogram","approximate")
+
+def computeMedian(data,axis=-1,method="numpy",resolution=1.,out=None):
+    """
+    Median of data along axis with a selectable backend:
+          numpy       - np.median
+          partition   - a selection (np.partition) of the one or two central values, exact
+          histogram   - a counting median over the (narrow) range of values, exact for data which are integer
+                        multiples of "resolution" (e.g. ADC counts, or pedestal subtracted counts with resolution 0.5)
+          approximate - the histogram median after rounding the data to the nearest multiple of "resolution", so
+                        within resolution/2 of the exact median
+    The result has the same type and shape as np.median would return. If out is given the result is written there.
+    """
+    data = np.asarray(data)
+
+    if method == "numpy":
+        return np.median(data,axis=axis,out=out)
+    elif method == "partition":
+        median = partitionMedian(data,axis)
+    elif method == "histogram":
+        median = histogramMedian(data,axis,resolution,exact=True)
+    elif method == "approximate":
+        median = histogramMedian(data,axis,resolution,exact=False)
     else:
-        waveLessPed = waveforms - pedestals
-    rms = np.sqrt(np.mean(np.square(waveLessPed),axis=-1))
+        raise ValueError("Unknown median method "+str(method)+", choose one of "+str(medianMethods))
+
+    if out is not None:
+        out[...] = median
+        return out
+
+    return median
+
+def medianType(data):
+    # np.median returns the input type for floats and float64 otherwise
+    return data.dtype if np.issubdtype(data.dtype,np.floating) else np.dtype(np.float64)
+
+def partitionMedian(data,axis=-1):
+    nVals  = data.shape[axis]
+    lowIdx = (nVals - 1) // 2
+    hiIdx  = nVals // 2
+
+    selected = np.partition(data,sorted({lowIdx,hiIdx}),axis=axis)
+    median   = np.take(selected,lowIdx,axis=axis).astype(medianType(data))
+
+    if hiIdx != lowIdx:
+        median += np.take(selected,hiIdx,axis=axis)
+        median *= 0.5
+
+    return median
+
+def histogramMedian(data,axis=-1,resolution=1.,exact=True,maxBins=1<<22):
+    """
+    Counting median: the values are binned at the given resolution and a single bincount, with an offset per output
+    element, gives the histogram of every row (along axis) at once. The cumulative counts then locate the central
+    values. The data are never transposed, large inputs are split along another axis so that the histograms never
+    exceed maxBins entries. Falls back to the partition median if the range of values is too wide.
+    """
+    if data.size == 0:
+        return partitionMedian(data,axis)
+
+    axis    = axis % data.ndim
+    outType = medianType(data)
+
+    if np.issubdtype(data.dtype,np.integer) and resolution == 1.:
+        binned = data
+    else:
+        scaled = data / resolution
+        binned = np.rint(scaled)
+        if exact and not np.array_equal(binned,scaled):
+            raise ValueError("The histogram median requires values which are multiples of the resolution, use method='approximate'")
+
+    minVal = int(binned.min())
+    nBins  = int(binned.max()) - minVal + 1
+
+    if nBins > maxBins:
+        return partitionMedian(data,axis)
+
+    median  = countingMedian(binned,axis,minVal,nBins,maxBins).astype(outType)
+    median *= resolution
+
+    return median
+
+def countingMedian(binned,axis,minVal,nBins,maxBins):
+    # binned holds integer valued bins in [minVal,minVal+nBins), returns the median (a half integer for an even number of values)
+    nVals    = binned.shape[axis]
+    outShape = binned.shape[:axis] + binned.shape[axis+1:]
+    nRows    = int(np.prod(outShape))
+
+    # Too many histogram bins, split along the first of the other axes which can still be split
+    splitAxes = [idx for idx in range(binned.ndim) if idx != axis and binned.shape[idx] > 1]
+    if nRows * nBins > maxBins and splitAxes:
+        chunkAxis = splitAxes[0]
+        chunkLen  = max(1,maxBins // (nBins * nRows // binned.shape[chunkAxis]))
+        chunks    = [countingMedian(np.take(binned,range(first,min(first+chunkLen,binned.shape[chunkAxis])),axis=chunkAxis),axis,minVal,nBins,maxBins)
+                     for first in range(0,binned.shape[chunkAxis],chunkLen)]
+        return np.concatenate(chunks,axis=chunkAxis if chunkAxis < axis else chunkAxis-1)
+
+    # Each output element gets its own range of nBins bins in one long histogram
+    rowOffsets = np.expand_dims(np.arange(nRows,dtype=np.intp).reshape(outShape) * nBins - minVal,axis)
+    binIndex   = np.add(binned,rowOffsets,dtype=np.intp,casting="unsafe")
+    counts     = np.bincount(binIndex.ravel(),minlength=nRows*nBins).reshape(nRows,nBins)
+    cumCounts  = np.cumsum(counts,axis=1)
+    lowBin     = np.argmax(cumCounts > (nVals - 1) // 2,axis=1)
+    hiBin      = np.argmax(cumCounts > nVals // 2,axis=1)
+
+    return (minVal + 0.5 * (lowBin + hiBin)).reshape(outShape)
+
+def getPedestalsAndRMS(waveforms,medianMethod="numpy",dtype=None,out=None):
+    """
+    Determine the pedestal (median) of each waveform, subtract it and compute the rms of the result
+    args: waveforms    - input waveforms, the last dimension being ticks
+          medianMethod - the median backend to use, see computeMedian
+          dtype        - the (floating point) type to do the subtraction in (e.g. np.float32), defaults to float64
+                         for integer input
+          out          - optional preallocated floating point buffer for the pedestal subtracted waveforms, which may
+                         be the input waveforms themselves for an in place subtraction of float waveforms (integer ADC
+                         waveforms can't hold the fractional pedestals, so they need a separate float buffer)
+    The rms is accumulated directly from the subtracted waveforms so the squared waveforms are never stored
+    """
+    if out is not None and not np.issubdtype(out.dtype,np.floating):
+        raise ValueError("getPedestalsAndRMS needs a floating point out buffer, not "+str(out.dtype))
+    if dtype is not None and not np.issubdtype(dtype,np.floating):
+        raise ValueError("getPedestalsAndRMS needs a floating point dtype, not "+str(np.dtype(dtype)))
+
+    # The pedestals keep their own (float) type, they are half integers for integer ADC values
+    pedestals = computeMedian(waveforms,axis=-1,method=medianMethod)
+
+    if out is None:
+        outType = dtype if dtype is not None else np.result_type(waveforms.dtype,pedestals.dtype)
+        out     = np.empty(np.shape(waveforms),dtype=outType)
+
+    waveLessPed = np.subtract(waveforms,pedestals[...,None],out=out,casting="unsafe")
+    rms         = np.sqrt(np.einsum("...t,...t->...",waveLessPed,waveLessPed,dtype=np.result_type(out.dtype,np.float32)) / waveLessPed.shape[-1])
     return waveLessPed,pedestals,rms
 
-def getMedianNoiseCorrection(waveforms):
-    median           = np.median(waveforms,axis=0)
-    waveLessCoherent = waveforms - median.transpose()
+def getMedianNoiseCorrection(waveforms,medianMethod="numpy"):
+    median           = computeMedian(waveforms,axis=0,method=medianMethod)
+    waveLessCoherent = waveforms - median
     rms              = np.sqrt(np.mean(np.square(waveLessCoherent),axis=0))
     return waveLessCoherent,median,rms
 
-def removeCoherentNoise(waveforms,grouping,nTicks):
-    # Define placeholders for the output arrays
-    waveLessCoherent = np.array([0])
-    median           = np.array([0])
-    intrinsicRMS     = np.array([0])
-    
-    nChannels = waveforms.shape[0]
-    
-    for idx in range(0,nChannels,grouping):
-        temp,tempMed,tempRMS = getMedianNoiseCorrection(waveforms[idx:idx+grouping,:])
-        if idx == 0:
-            waveLessCoherent = temp
-            median           = tempMed
-            intrinsicRMS     = tempRMS
-        else:
-            waveLessCoherent = np.concatenate((waveLessCoherent,temp),axis=0)
-            median           = np.concatenate((median,tempMed),axis=0)
-            intrinsicRMS     = np.concatenate((intrinsicRMS,tempRMS),axis=0)
-        
-    median       = median.transpose().reshape(nChannels//grouping,nTicks)         # Now we make a 2D array of 384 channels by 4096+2 ticks
-    intrinsicRMS = intrinsicRMS.transpose().reshape(nChannels//grouping,nTicks)   # Now we make a 2D array of 384 channels by 4096+2 ticks
+def removeCoherentNoise(waveforms,grouping,nTicks=None,medianMethod="numpy"):
+    """
+    Remove the noise which is coherent across groups of "grouping" consecutive channels by subtracting, tick by tick,
+    the median over the channels in each group. All groups are done at once by viewing the waveforms as an array of
+    shape (nGroups,grouping,nTicks) and writing into preallocated outputs.
+    args: waveforms - pedestal subtracted waveforms of shape (nChannels,nTicks), or a stack of events with shape
+                      (nEvents,nChannels,nTicks)
+          grouping  - the number of consecutive channels in a group. If nChannels is not a multiple of grouping the
+                      last group holds the remaining channels
+          nTicks    - kept for backwards compatibility, the number of ticks is taken from the waveforms
+          medianMethod - the median backend to use, see computeMedian
+    returns: waveLessCoherent with the same shape as the input, and the median and intrinsic rms of each group at
+             each tick, of shape (nGroups,nTicks) (or (nEvents,nGroups,nTicks))
+    """
+    return subtractGroupMedians(waveforms,waveforms,grouping,medianMethod)
 
-    return waveLessCoherent,median,intrinsicRMS
+def subtractGroupMedians(waveforms,selected,grouping,medianMethod="numpy"):
+    """
+    The core of the coherent noise removal: the tick by tick median over the channels of each group is taken from
+    "selected" (the waveforms themselves, or a version with signal regions masked) and subtracted from "waveforms".
+    Shapes and outputs are as described in removeCoherentNoise.
+    """
+    waveforms = np.asarray(waveforms)
+    selected  = np.asarray(selected)
+    leading   = waveforms.shape[:-2]
+    nChannels = waveforms.shape[-2]
+    nTicks    = waveforms.shape[-1]
+    nGroups   = -(-nChannels // grouping)
+    outType   = waveforms.dtype if np.issubdtype(waveforms.dtype,np.floating) else np.float64
+
+    # Define the output arrays
+    waveLessCoherent = np.empty(waveforms.shape,dtype=outType)
+    median           = np.empty(leading+(nGroups,nTicks),dtype=outType)
+    intrinsicRMS     = np.empty(leading+(nGroups,nTicks),dtype=outType)
+
+    # The full groups and then, if needed, the remainder group
+    for firstGroup,lastGroup,groupSize in groupRanges(nChannels,grouping):
+        firstChannel = firstGroup * grouping
+        lastChannel  = firstChannel + (lastGroup - firstGroup) * groupSize
+        groupShape   = leading + (lastGroup-firstGroup,groupSize,nTicks)
+
+        grouped      = waveforms[...,firstChannel:lastChannel,:].reshape(groupShape)
+        groupedSel   = selected[...,firstChannel:lastChannel,:].reshape(groupShape)
+        groupedOut   = waveLessCoherent[...,firstChannel:lastChannel,:].reshape(groupShape)
+        groupMedian  = median[...,firstGroup:lastGroup,:]
+        groupRMS     = intrinsicRMS[...,firstGroup:lastGroup,:]
+
+        computeMedian(groupedSel,axis=-2,method=medianMethod,out=groupMedian)
+        np.subtract(grouped,groupMedian[...,None,:],out=groupedOut)
+
+        # Sum of squares over the channels in the group without building the squared array
+        np.einsum("...ct,...ct->...t",groupedOut,groupedOut,out=groupRMS)
+        groupRMS /= groupSize
+
+    np.sqrt(intrinsicRMS,out=intrinsicRMS)
 
-def removeCoherentNoiseMorphCollection(waveforms,grouping,nTicks,structuringElement=(3,6)):
-    nChannels = waveforms.shape[0]
-    nGroups   = nChannels // grouping
-    
-    # Define placeholders for the output arrays
-    waveLessCoherent = np.zeros(waveforms.shape)
-    median           = np.zeros((nGroups,nTicks))
-    intrinsicRMS     = np.zeros((nGroups,nTicks))
-    
-    for idx in range(0,nChannels,grouping):
-#        erosion      = ndimage.grey_erosion(waveforms[idx:idx+grouping,:],size=structuringElement)
-        dilation     = ndimage.grey_dilation(waveforms[idx:idx+grouping,:],size=structuringElement)
-        dilationMed  = np.median(dilation,axis=-1)
-        dilationBase = dilation - dilationMed[:,None]
-        dilationRMS  = np.sqrt(np.mean(np.square(dilationBase),axis=-1))
-        selectVals   = dilationMed + 2.5 * dilationRMS
-        thisGroup    = idx // grouping
-
-        median[thisGroup,:]                  = np.median(np.where(dilation<selectVals[:,None],waveforms[idx:idx+grouping,:],0.),axis=0)
-        waveLessCoherent[idx:idx+grouping,:] = waveforms[idx:idx+grouping,:] - median[thisGroup,:]
-        intrinsicRMS[thisGroup,:]            = np.sqrt(np.mean(np.square(waveLessCoherent[idx:idx+grouping,:]),axis=0))
-        
     return waveLessCoherent,median,intrinsicRMS
 
-def removeCoherentNoiseMorphInduction(waveforms,grouping,nTicks,structuringElement=(3,6)):
+def groupRanges(nChannels,grouping):
+    """
+    Split nChannels into groups of "grouping" channels, returning a list of (firstGroup,lastGroup+1,groupSize)
+    covering the full groups and, if nChannels is not a multiple of grouping, a last group with the remainder
+    """
+    nFull  = nChannels // grouping
+    ranges = []
+    if nFull > 0:
+        ranges.append((0,nFull,grouping))
+    if nChannels % grouping > 0:
+        ranges.append((nFull,nFull+1,nChannels % grouping))
+    return ranges
+
+def getMorphologicalImages(waveforms,grouping,structuringElement=(3,6)):
+    """
+    Compute the grey scale dilation, erosion and gradient (dilation - erosion) of the waveforms once for the whole
+    plane, to be shared by the morphological coherent noise removers below. As before each group of channels is
+    filtered on its own, but all groups are done in a single call by adding a group axis to the image (with a
+    structuring element of size 1 along it). For the rectangular structuring element used here scipy applies the
+    filter separably with running max/min along each axis, so the cost does not grow with the element size.
+    args: waveforms          - (nChannels,nTicks) pedestal subtracted waveforms
+          grouping           - the number of consecutive channels in a group
+          structuringElement - the (channels,ticks) size of the structuring element
+    returns: dilation,erosion,gradient, each with the shape of the input waveforms
+    """
+    waveforms = np.asarray(waveforms)
     nChannels = waveforms.shape[0]
-    nGroups   = nChannels // grouping
-    
-    # Define placeholders for the output arrays
-    waveLessCoherent = np.zeros(waveforms.shape)
-    median           = np.zeros((nGroups,nTicks))
-    intrinsicRMS     = np.zeros((nGroups,nTicks))
-    
-    for idx in range(0,nChannels,grouping):
-        gradient     = ndimage.grey_dilation(waveforms[idx:idx+grouping,:],size=structuringElement) \
-                     - ndimage.grey_erosion(waveforms[idx:idx+grouping,:],size=structuringElement)
-        gradientMed  = np.median(gradient,axis=-1)
-        gradientBase = gradient - gradientMed[:,None]
-        gradientRMS  = np.sqrt(np.mean(np.square(gradientBase),axis=-1))
-        print("Group:",idx,", median:",gradientMed,",\n rms:",gradientRMS)
-        selectVals   = 2.5 * gradientRMS
-        thisGroup    = idx // grouping
-
-        median[thisGroup,:]                  = np.median(np.where(gradientBase<selectVals[:,None],waveforms[idx:idx+grouping,:],0.),axis=0)
-        waveLessCoherent[idx:idx+grouping,:] = waveforms[idx:idx+grouping,:] - median[thisGroup,:]
-        intrinsicRMS[thisGroup,:]            = np.sqrt(np.mean(np.square(waveLessCoherent[idx:idx+grouping,:]),axis=0))
-        
-    return waveLessCoherent,median,intrinsicRMS
+    nTicks    = waveforms.shape[-1]
+    dilation  = np.empty(waveforms.shape,dtype=waveforms.dtype)
+    erosion   = np.empty(waveforms.shape,dtype=waveforms.dtype)
+
+    for firstGroup,lastGroup,groupSize in groupRanges(nChannels,grouping):
+        firstChannel = firstGroup * grouping
+        lastChannel  = firstChannel + (lastGroup - firstGroup) * groupSize
+        groupShape   = (lastGroup-firstGroup,groupSize,nTicks)
+        size         = (1,) + tuple(structuringElement)
+        grouped      = waveforms[firstChannel:lastChannel].reshape(groupShape)
+
+        ndimage.grey_dilation(grouped,size=size,output=dilation[firstChannel:lastChannel].reshape(groupShape))
+        ndimage.grey_erosion( grouped,size=size,output=erosion[firstChannel:lastChannel].reshape(groupShape))
+
+    gradient = dilation - erosion
+
+    return dilation,erosion,gradient
+
+def removeCoherentNoiseMorphCollection(waveforms,grouping,nTicks,structuringElement=(3,6),medianMethod="numpy",morphology=None):
+    """
+    Coherent noise removal with signal protection for the collection plane: ticks where the dilated waveform is
+    more than 2.5 rms above its median are excluded (set to zero) when forming the group medians.
+    args: as removeCoherentNoise, plus structuringElement for the morphological filter and optionally morphology,
+          the output of getMorphologicalImages for these waveforms, to avoid recomputing it
+    """
+    if morphology is None:
+        morphology = getMorphologicalImages(waveforms,grouping,structuringElement)
+
+    dilation     = morphology[0]
+    dilationMed  = computeMedian(dilation,axis=-1,method=medianMethod)
+    dilationBase = dilation - dilationMed[:,None]
+    dilationRMS  = np.sqrt(np.einsum("ct,ct->c",dilationBase,dilationBase) / dilation.shape[-1])
+    selectVals   = dilationMed + 2.5 * dilationRMS
+    selected     = np.where(dilation<selectVals[:,None],waveforms,0.)
+
+    return subtractGroupMedians(waveforms,selected,grouping,medianMethod)
+
+def removeCoherentNoiseMorphInduction(waveforms,grouping,nTicks,structuringElement=(3,6),medianMethod="numpy",morphology=None):
+    """
+    Coherent noise removal with signal protection for the induction planes: ticks where the morphological gradient
+    is more than 2.5 rms above its median are excluded (set to zero) when forming the group medians.
+    args: as removeCoherentNoiseMorphCollection
+    """
+    if morphology is None:
+        morphology = getMorphologicalImages(waveforms,grouping,structuringElement)
 
+    gradient     = morphology[2]
+    gradientMed  = computeMedian(gradient,axis=-1,method=medianMethod)
+    gradientBase = gradient - gradientMed[:,None]
+    gradientRMS  = np.sqrt(np.einsum("ct,ct->c",gradientBase,gradientBase) / gradient.shape[-1])
+    selectVals   = 2.5 * gradientRMS
+    selected     = np.where(gradientBase<selectVals[:,None],waveforms,0.)
 
+    return subtractGroupMedians(waveforms,selected,grouping,medianMethod)
@@ -0,0 +1,107 @@
+# Region of interest (ROI) finding on noise filtered waveforms
+# Ticks above threshold are found for all channels at once, padded and merged
+# into ROIs which are returned in the compact RegionsOfInterest form
+#
+# Assuming input waveforms have last dimension to be the waveforms
+
+import numpy as np
+from sigproc_tools.sigproc_functions.noiseProcessing import getPedestalsAndRMS
+from sigproc_tools.sigproc_objects.regionsofinterest import RegionsOfInterest
+
+def getThresholds(rms,threshold,nChannels,nTicks,grouping=None):
+    """
+    Convert the noise estimate into per channel (or per channel and tick) thresholds which broadcast against the
+    (nChannels,nTicks) waveforms
+    args: rms       - a single value, the per channel rms of shape (nChannels,) as returned by getPedestalsAndRMS, or
+                      the per group intrinsic rms of shape (nGroups,nTicks) as returned by removeCoherentNoise (which
+                      then needs "grouping")
+          threshold - the threshold in units of the rms
+    """
+    rms = np.asarray(rms,dtype=np.float32)
+
+    if rms.ndim == 0:
+        return threshold * rms
+    elif rms.ndim == 1:
+        return threshold * rms[:,None]
+    elif rms.shape[-1] == nTicks and grouping is not None:
+        return threshold * np.repeat(rms,grouping,axis=0)[:nChannels]
+
+    raise ValueError("rms must be a scalar, per channel or (nGroups,nTicks) with a grouping, got shape "+str(rms.shape))
+
+def findROIRanges(waveforms,thresholds,padding=(10,20),mergeGap=0,bipolar=True):
+    """
+    Find the ROIs as (channel,startTick,endTick) ranges, endTick being one past the last tick
+    args: waveforms  - pedestal (and coherent noise) subtracted waveforms of shape (nChannels,nTicks)
+          thresholds - the thresholds in ADC, anything broadcasting against the waveforms (see getThresholds)
+          padding    - number of ticks added (before,after) each run of ticks over threshold, or a single number for both
+          mergeGap   - padded runs on the same channel separated by no more than this number of ticks are merged
+          bipolar    - threshold the absolute value (induction planes), otherwise only positive excursions count
+    The runs are found with a single diff of the threshold mask, padding and merging are done on the run arrays so
+    there is no loop over channels or ticks
+    """
+    nChannels,nTicks = waveforms.shape
+    padBefore,padAfter = (padding,padding) if np.isscalar(padding) else padding
+
+    overThreshold = (np.abs(waveforms) if bipolar else waveforms) > thresholds
+
+    # Frame each channel with False so every run has a rising and a falling edge in the same row
+    framed        = np.zeros((nChannels,nTicks+2),dtype=np.int8)
+    framed[:,1:-1] = overThreshold
+    edges         = np.diff(framed,axis=1)
+
+    channels,startTicks = np.nonzero(edges == 1)
+    _,endTicks          = np.nonzero(edges == -1)
+
+    startTicks = np.maximum(startTicks - padBefore,0)
+    endTicks   = np.minimum(endTicks + padAfter,nTicks)
+
+    if len(channels) > 1:
+        # Runs are ordered by channel then tick and the padded ends never decrease along a channel, so a new ROI
+        # starts whenever the channel changes or the gap to the previous run is too large
+        newROI     = np.ones(len(channels),dtype=bool)
+        newROI[1:] = (channels[1:] != channels[:-1]) | (startTicks[1:] - endTicks[:-1] > mergeGap)
+        firstRuns  = np.flatnonzero(newROI)
+        lastRuns   = np.append(firstRuns[1:],len(channels)) - 1
+
+        channels   = channels[firstRuns]
+        startTicks = startTicks[firstRuns]
+        endTicks   = endTicks[lastRuns]
+
+    return channels,startTicks,endTicks
+
+def extractROIs(waveforms,channels,startTicks,endTicks,dtype=np.float32):
+    """
+    Gather the samples of the given (channel,startTick,endTick) ranges into a RegionsOfInterest
+    """
+    nChannels,nTicks = waveforms.shape
+    lengths          = endTicks - startTicks
+    offsets          = np.zeros(len(lengths)+1,dtype=np.int64)
+    np.cumsum(lengths,out=offsets[1:])
+
+    flatIndices = np.repeat(channels * nTicks + startTicks - offsets[:-1],lengths) + np.arange(offsets[-1])
+    samples     = np.ravel(waveforms)[flatIndices].astype(dtype,copy=False)
+
+    return RegionsOfInterest(channels,startTicks,offsets,samples,nChannels,nTicks)
+
+def findROIs(waveforms,rms=None,threshold=4.,padding=(10,20),mergeGap=0,grouping=None,bipolar=True,dtype=np.float32,medianMethod="numpy"):
+    """
+    Find the regions of interest in a set of noise filtered waveforms
+    args: waveforms - pedestal (and coherent noise) subtracted waveforms of shape (nChannels,nTicks)
+          rms       - the noise to threshold against, see getThresholds. If None the per channel rms is computed
+                      with getPedestalsAndRMS
+          threshold - the threshold in units of the rms
+          padding, mergeGap, bipolar - see findROIRanges
+          grouping  - needed when rms is the per group intrinsic rms
+          dtype     - the type the ROI samples are stored as
+    returns: a RegionsOfInterest holding only the ticks in the ROIs
+    """
+    waveforms        = np.asarray(waveforms)
+    nChannels,nTicks = waveforms.shape
+
+    if rms is None:
+        _,_,rms = getPedestalsAndRMS(waveforms,medianMethod=medianMethod,dtype=np.float32)
+
+    thresholds                   = getThresholds(rms,threshold,nChannels,nTicks,grouping)
+    channels,startTicks,endTicks = findROIRanges(waveforms,thresholds,padding,mergeGap,bipolar)
+
+    return extractROIs(waveforms,channels,startTicks,endTicks,dtype)
@@ -0,0 +1,21 @@
+# The object modules, and the classes they define, are imported on first use
+from sigproc_tools.lazyimport import lazyPackage as _lazyPackage
+
+_submodules = ("deconvolution","electronicsresponse","fieldresponse","filterevents","fullresponse","instrumentation",
+               "noisestatistics","powerspectrum","rawdigit","rawdigitstore","regionsofinterest","responsecache")
+
+_objects    = "sigproc_tools.sigproc_objects."
+
+_attributes = {"Deconvolver"              : _objects+"deconvolution",
+               "ElectronicsResponse"      : _objects+"electronicsresponse",
+               "FieldResponse"            : _objects+"fieldresponse",
+               "FilterEvents"             : _objects+"filterevents",
+               "FullResponse"             : _objects+"fullresponse",
+               "Instrumentation"          : _objects+"instrumentation",
+               "NoiseStatistics"          : _objects+"noisestatistics",
+               "PowerSpectrumAccumulator" : _objects+"powerspectrum",
+               "RawDigit"                 : _objects+"rawdigit",
+               "RawDigitStore"            : _objects+"rawdigitstore",
+               "RegionsOfInterest"        : _objects+"regionsofinterest"}
+
+__getattr__,__dir__ = _lazyPackage(__name__,_submodules,_attributes)
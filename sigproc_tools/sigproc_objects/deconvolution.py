@@ -0,0 +1,110 @@
+# numpy is the source of all life in python
+import numpy as np
+from sigproc_tools.lazyimport import lazyModule
+
+# scipy is imported on first use
+sfft = lazyModule("scipy.fft")
+
+# An object to deconvolve the full response from waveforms
+
+class Deconvolver:
+    """
+    Deconvolver: removes the response described by a FullResponse from a set of waveforms, returning the (filtered)
+    charge deposits. In frequency space the waveforms are multiplied by a regularized (Wiener) inverse of the
+    response, conj(R) / (|R|^2 + noiseToSignal x max|R|^2), times an optional gaussian low pass filter in time.
+    Optionally a gaussian filter across wires is applied too, as in the production 2D deconvolution.
+    Everything is done with batched rfft/irfft along the ticks (and fft across the wires) in chunks, by default in
+    float32 and using all cores for the FFTs.
+    """
+    def __init__(self,fullResponse,gaussWidth=0.12,noiseToSignal=1.e-4,wireFilterWidth=None,kind="full",dtype=np.float32,workers=-1):
+        """
+        args: fullResponse    - the FullResponse to remove
+              gaussWidth      - sigma of the gaussian time filter in MHz (Nyquist is 1.25 MHz), None for no filter
+              noiseToSignal   - the Wiener regularization of the inverse, relative to the peak response power
+              wireFilterWidth - sigma of the gaussian wire filter in cycles/wire (Nyquist is 0.5), None for a 1D
+                                (channel by channel) deconvolution
+              kind            - the response to remove, "full" or "electronics"
+              dtype           - the type to work in and return, np.float32 or np.float64
+              workers         - number of threads for scipy.fft, -1 for all cores
+        """
+        self.fullResponse    = fullResponse
+        self.gaussWidth      = gaussWidth
+        self.noiseToSignal   = noiseToSignal
+        self.wireFilterWidth = wireFilterWidth
+        self.kind            = kind
+        self.dtype           = np.dtype(dtype)
+        self.complexType     = np.result_type(self.dtype,np.complex64)
+        self.workers         = workers
+        self.timeFilters     = {}
+        self.wireFilters     = {}
+
+    def getTimeFilter(self,numTicks):
+        """
+        Returns (and caches) the combined inverse response and time filter for waveforms of numTicks ticks
+        """
+        if numTicks not in self.timeFilters:
+            response    = self.fullResponse.getResponseFFT(numTicks,kind=self.kind)
+            power       = np.abs(response)**2
+            timeFilter  = np.conj(response) / (power + self.noiseToSignal * np.max(power))
+
+            if self.gaussWidth is not None:
+                frequencies = sfft.rfftfreq(numTicks,d=self.fullResponse.TPCTickWidth)
+                timeFilter *= np.exp(-0.5 * (frequencies / self.gaussWidth)**2)
+
+            self.timeFilters[numTicks] = timeFilter.astype(self.complexType)
+
+        return self.timeFilters[numTicks]
+
+    def getWireFilter(self,numChannels):
+        """
+        Returns (and caches) the gaussian filter in wire frequency for planes of numChannels channels
+        """
+        if numChannels not in self.wireFilters:
+            frequencies = sfft.fftfreq(numChannels)
+            self.wireFilters[numChannels] = np.exp(-0.5 * (frequencies / self.wireFilterWidth)**2).astype(self.dtype)
+
+        return self.wireFilters[numChannels]
+
+    def deconvolve(self,waveforms,chunkSize=128,shiftT0=False):
+        """
+        Deconvolve waveforms of shape (nChannels,nTicks) or (nEvents,nChannels,nTicks)
+        args: chunkSize - the number of channels transformed at a time for the 1D deconvolution (the 2D deconvolution
+                          always works on one full plane at a time)
+              shiftT0   - undo the T0 shift applied by FullResponse.convolve/genSpikeWaveform, so deposits come back
+                          at the tick they were made
+        returns: the deconvolved waveforms with the same shape as the input, in self.dtype
+        """
+        waveforms  = np.asarray(waveforms)
+        nChannels  = waveforms.shape[-2]
+        nTicks     = waveforms.shape[-1]
+        timeFilter = self.getTimeFilter(nTicks)
+        t0Ticks    = self.fullResponse.getT0Ticks(self.kind) if shiftT0 else 0
+        output     = np.empty(waveforms.shape,dtype=self.dtype)
+
+        if self.wireFilterWidth is None:
+            blocks     = waveforms.reshape(-1,nTicks)
+            outBlocks  = output.reshape(-1,nTicks)
+            wireFilter = None
+        else:
+            blocks     = waveforms.reshape(-1,nChannels,nTicks)
+            outBlocks  = output.reshape(-1,nChannels,nTicks)
+            wireFilter = self.getWireFilter(nChannels)
+            chunkSize  = 1
+
+        for first in range(0,len(blocks),chunkSize):
+            deconvolved = self.deconvolveBlock(blocks[first:first+chunkSize],timeFilter,wireFilter)
+            outBlocks[first:first+chunkSize] = np.roll(deconvolved,t0Ticks,axis=-1) if t0Ticks != 0 else deconvolved
+
+        return output
+
+    def deconvolveBlock(self,block,timeFilter,wireFilter=None):
+        nTicks    = block.shape[-1]
+        spectrum  = sfft.rfft(block.astype(self.dtype,copy=False),axis=-1,workers=self.workers)
+        spectrum *= timeFilter
+
+        if wireFilter is not None:
+            spectrum  = sfft.fft(spectrum,axis=-2,workers=self.workers,overwrite_x=True)
+            spectrum *= wireFilter[:,None]
+            spectrum  = sfft.ifft(spectrum,axis=-2,workers=self.workers,overwrite_x=True)
+
+        return sfft.irfft(spectrum,n=nTicks,axis=-1,workers=self.workers,overwrite_x=True)
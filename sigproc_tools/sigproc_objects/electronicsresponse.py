@@ -1,6 +1,5 @@
 # numpy is the source of all life in python
 import numpy as np
-import uproot
 
 # An object for handling RawDigits from art root files
 
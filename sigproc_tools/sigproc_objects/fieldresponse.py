@@ -1,6 +1,9 @@
 # numpy is the source of all life in python
 import numpy as np
-import uproot
+from sigproc_tools.lazyimport import lazyModule
+
+# uproot is only imported when a response file is actually read
+uproot = lazyModule("uproot")
 
 # An object for handling RawDigits from art root files
 
@@ -1,69 +1,313 @@
 # numpy is the source of all life in python
 import numpy as np
-from sigproc_tools.sigproc_functions.noiseProcessing import *
+import collections
+import concurrent.futures
+from sigproc_tools.sigproc_functions.noiseProcessing import getPedestalsAndRMS,removeCoherentNoise
+from sigproc_tools.sigproc_functions.roiFinder import findROIs
 from sigproc_tools.sigproc_objects.rawdigit import RawDigit
+from sigproc_tools.sigproc_objects.instrumentation import Instrumentation,instrumentation,getAvailableMemory
+
+# Process a contiguous slice of events, this is the unit of work handed to each worker in parallel mode
+# (kept at module level so that it can be pickled for a process pool)
+def filterEventChunk(rawdigits,grouping,eventNos):
+    """
+    Read and filter the events in eventNos, returning a list with one entry per event:
+          (eventNo,waveLessPed,pedestals,rms,waveLessCoherent,median,intrinsicRMS)
+    or None for events which have no RawDigits
+    """
+    results = []
+
+    for eventNo in eventNos:
+        # Skip events with no RawDigits (can happen in multiTPC readout)
+        if rawdigits.numChannels(eventNo) == 0:
+            results.append(None)
+            continue
+
+        with instrumentation.stage("filterEvent") as stage:
+            with instrumentation.stage("getWaveforms"):
+                waveforms = rawdigits.getWaveforms(eventNo)
+
+            nTicks = waveforms.shape[-1]
+
+            with instrumentation.stage("getPedestalsAndRMS"):
+                waveLessPed,pedestals,rms = getPedestalsAndRMS(waveforms)
+
+            with instrumentation.stage("removeCoherentNoise"):
+                waveLessCoherent,median,intrinsicRMS = removeCoherentNoise(waveLessPed,grouping,nTicks)
+            stage.add(waveforms.nbytes,1)
+
+        results.append((eventNo,waveLessPed,pedestals,rms,waveLessCoherent,median,intrinsicRMS))
+
+    return results
+
+def filterEventChunkInstrumented(rawdigits,grouping,eventNos,traceMemory=False):
+    """
+    filterEventChunk for a worker process: the stages of this chunk are recorded in the worker's own instrumentation
+    and handed back, as a fresh Instrumentation, with the results so the parent process can merge them
+    returns: the list of results of filterEventChunk and the Instrumentation of the chunk
+    """
+    # A forked worker starts with a copy of the parent's counters, only what this chunk does should be sent back
+    instrumentation.reset()
+    if not instrumentation.enabled or instrumentation.traceMemory != traceMemory:
+        instrumentation.enable(traceMemory)
+
+    results    = filterEventChunk(rawdigits,grouping,eventNos)
+    chunkStats = Instrumentation().merge(instrumentation)
+    instrumentation.reset()
+
+    return results,chunkStats
 
 # An object which will perform basic noise filtering on an input data set of RawDigits
 
 class FilterEvents:
     """
-    The goal here is to provide access to a series of objects that represent RawDigit waveforms 
+    The goal here is to provide access to a series of objects that represent RawDigit waveforms
     after several noise filter steps have been performed including coherent noise subtraction
     """
-    def __init__(self,eventsFolder,producer):
+    def __init__(self,eventsFolder,producer=None,readChunkSize=1,cacheMemory=512*1024*1024):
         """
-        args: eventsFolder is the folder containing the desired RawDigits by event
+        args: eventsFolder is the folder containing the desired RawDigits by event, or an object which already
+                           provides the RawDigit interface (e.g. a RawDigitStore) in which case producer is not needed
               producer is the path to the RawDigits for uproot to decode when looking them up
+              readChunkSize and cacheMemory control the bulk reads and event cache of the RawDigits
         """
-        self.rawdigits = RawDigit(eventsFolder,producer)
+        if hasattr(eventsFolder,"getWaveforms"):
+            self.rawdigits = eventsFolder
+        else:
+            self.rawdigits = RawDigit(eventsFolder,producer,readChunkSize,cacheMemory)
 
-    # Given direct access to the RawDigits to recover its functionality 
+    # Given direct access to the RawDigits to recover its functionality
     def getRawDigits(self):
         return self.rawdigits
 
+    # Estimate the memory needed to filter the events
+    def estimateMemory(self,grouping,numEvents=None,eventNum=None):
+        """
+        Estimate, from the size of one event, the memory needed by the event loop
+        args: grouping  - the number of channels to group together for coherent noise subtraction
+              numEvents - the number of events whose outputs are kept (filterEvents), defaults to all events
+              eventNum  - the (non empty) event to take the sizes from, defaults to the first non empty event
+        returns: a dictionary with
+              outputBytes   - the arrays filled by filterEvents for numEvents events
+              eventBytes    - the working memory of one event being filtered (raw waveforms plus all outputs)
+              availableBytes - the memory currently available on this machine (None if unknown)
+        """
+        if numEvents is None:
+            numEvents = self.rawdigits.numEvents()
+
+        if eventNum is None:
+            eventNum = next((idx for idx in range(self.rawdigits.numEvents()) if self.rawdigits.numChannels(idx) > 0),0)
+
+        nChannels   = int(self.rawdigits.numChannels(eventNum))
+        nTicks      = int(self.rawdigits.numTicks(eventNum)) if nChannels > 0 else 0
+        nGroups     = -(-nChannels // grouping)
+        floatSize   = np.dtype(np.float64).itemsize
+
+        # waveLessPed and waveLessCoherent per channel, median and intrinsicRMS per group, pedestals and rms per channel
+        outputBytes = (2 * nChannels * nTicks + 2 * nGroups * nTicks + 2 * nChannels) * floatSize
+        rawBytes    = nChannels * nTicks * np.dtype(np.int16).itemsize
+
+        return {"outputBytes"    : numEvents * outputBytes,
+                "eventBytes"     : rawBytes + outputBytes,
+                "availableBytes" : getAvailableMemory()}
+
+    def chooseChunkSize(self,grouping,numWorkers=1,storedBytes=0,memoryLimit=None,maxChunkSize=16,numEvents=None):
+        """
+        Pick the number of events per worker chunk so that the events in flight (up to 2 x numWorkers chunks) fit in
+        the memory left after storedBytes, memoryLimit defaulting to half of the available memory. With several
+        workers the chunks are also kept small enough that each worker gets (at least) two of the numEvents events
+        """
+        estimate   = self.estimateMemory(grouping,0)
+        numWorkers = max(1,numWorkers)
+
+        # Enough chunks for the work to balance over the workers
+        if numEvents is not None:
+            maxChunkSize = min(maxChunkSize,-(-numEvents // (2 * numWorkers)) if numWorkers > 1 else numEvents)
+
+        if memoryLimit is None:
+            if estimate["availableBytes"] is None:
+                return int(max(1,min(4,maxChunkSize)))
+            memoryLimit = estimate["availableBytes"] // 2
+
+        freeBytes = memoryLimit - storedBytes
+        inFlight  = 2 * numWorkers if numWorkers > 1 else 1
+
+        return int(max(1,min(maxChunkSize,freeBytes // (inFlight * max(1,estimate["eventBytes"])))))
+
     # Run the basic event loop
-    def filterEvents(self,grouping):
+    def filterEvents(self,grouping,numWorkers=1,chunkSize=None,useProcesses=False,memoryLimit=None):
         """
         Here we perform the noise filtering over all of the RawDigits available in the input file
-        args: grouping - the number of channels to group together for coherent noise subtraction
+        args: grouping     - the number of channels to group together for coherent noise subtraction
+              numWorkers   - the number of workers to spread the events over, 1 runs everything in this process
+              chunkSize    - the number of consecutive events handed to a worker at a time, None to choose it from
+                             the memory left once the output arrays are allocated (see chooseChunkSize)
+              useProcesses - use a process pool rather than a thread pool (the RawDigits must then be picklable)
+              memoryLimit  - the memory the event loop may use in bytes, defaults to the available memory
+        The memory needed for the output arrays is checked before anything is allocated, a MemoryError is raised up
+        front if it will not fit (iterateEvents can then be used instead). Without a memoryLimit the chunk size is
+        chosen to fit in half of the memory left once the outputs are allocated
         """
 
         eventNum  = 10
         numEvents = self.rawdigits.numEvents()
         nTicks    = self.rawdigits.numTicks(eventNum)
         nChannels = self.rawdigits.numChannels(eventNum)
-        nGroups   = nChannels // grouping
-        
+        nGroups   = -(-nChannels // grouping)   # a partial last group holds any remaining channels
+
         print("Number of channels:",nChannels,", grouping:",grouping,", nGroups:",nGroups)
-        
+
+        estimate   = self.estimateMemory(grouping,numEvents,eventNum)
+        allowBytes = memoryLimit if memoryLimit is not None else estimate["availableBytes"]
+
+        if allowBytes is not None and estimate["outputBytes"] + estimate["eventBytes"] > allowBytes:
+            raise MemoryError("Filtering "+str(numEvents)+" events needs "+str(estimate["outputBytes"] // 2**20)+" MB for the output arrays, "
+                              "more than the "+str(allowBytes // 2**20)+" MB "+("allowed" if memoryLimit is not None else "available")+
+                              ". Use iterateEvents to process the events one at a time")
+
+        if chunkSize is None:
+            chunkSize = self.chooseChunkSize(grouping,numWorkers,estimate["outputBytes"],memoryLimit,numEvents=numEvents)
+
         # Set up to loop over events
         # Define placeholders for the output arrays
-        self.waveLessPedAll      = np.ndarray([numEvents,nChannels,nTicks])
-        self.pedestalsAll        = np.ndarray([numEvents,nChannels])
-        self.rmsAll              = np.ndarray([numEvents,nChannels])
-        self.waveLessCoherentAll = np.ndarray([numEvents,nChannels,nTicks])
-        self.medianAll           = np.ndarray([numEvents,nGroups,nTicks])
-        self.intrinsicRMSAll     = np.ndarray([numEvents,nGroups,nTicks])
-        
-        locWaveforms        = np.ndarray((nChannels,nTicks))
-        
+        self.waveLessPedAll      = np.zeros([numEvents,nChannels,nTicks])
+        self.pedestalsAll        = np.zeros([numEvents,nChannels])
+        self.rmsAll              = np.zeros([numEvents,nChannels])
+        self.waveLessCoherentAll = np.zeros([numEvents,nChannels,nTicks])
+        self.medianAll           = np.zeros([numEvents,nGroups,nTicks])
+        self.intrinsicRMSAll     = np.zeros([numEvents,nGroups,nTicks])
+
         print("Applying filtering to ",numEvents,"events")
-        
-        for eventNo in range(numEvents):
-            locWaveforms                       = self.rawdigits.getWaveforms(eventNo)
-            self.waveLessPedAll[eventNo],      \
-            self.pedestalsAll[eventNo],        \
-            self.rmsAll[eventNo]               = getPedestalsAndRMS(locWaveforms)
-            self.waveLessCoherentAll[eventNo], \
-            self.medianAll[eventNo],           \
-            self.intrinsicRMSAll[eventNo]      = removeCoherentNoise(self.waveLessPedAll[eventNo],grouping,nTicks)
-            
+
+        for eventNo,waveLessPed,pedestals,rms,waveLessCoherent,median,intrinsicRMS in \
+                self.processEvents(grouping,range(numEvents),numWorkers,chunkSize,useProcesses):
+            self.waveLessPedAll[eventNo]      = waveLessPed
+            self.pedestalsAll[eventNo]        = pedestals
+            self.rmsAll[eventNo]              = rms
+            self.waveLessCoherentAll[eventNo] = waveLessCoherent
+            self.medianAll[eventNo]           = median
+            self.intrinsicRMSAll[eventNo]     = intrinsicRMS
+
             if eventNo%10 == 0:
                 print("--> Done with event ",eventNo)
-        
+
         print("Done")
 
         return numEvents
 
+    # Run the event loop one event at a time, keeping only running summaries
+    def iterateEvents(self,grouping,eventList=None,numWorkers=1,chunkSize=None,useProcesses=False):
+        """
+        Generator version of filterEvents which never holds more than a single event in memory. Each event is read
+        from the RawDigits, has its pedestals and coherent noise removed and is then handed back to the caller. Only
+        running per channel (per group for the intrinsic RMS) averages are kept in the object:
+              pedestalsMean, rmsMean, intrinsicRMSMean and numEventsSummed
+        args: grouping  - the number of channels to group together for coherent noise subtraction
+              eventList - optional iterable of event numbers to process, defaults to all events in the file
+              numWorkers, chunkSize, useProcesses - control parallel processing, see filterEvents. In parallel
+                          mode at most 2 x numWorkers chunks of events are held in memory at any time, by default
+                          the chunk size is chosen to fit in half of the available memory
+        yields: eventNo,waveLessPed,pedestals,rms,waveLessCoherent,median,intrinsicRMS for each non empty event
+        """
+        if eventList is None:
+            eventList = range(self.rawdigits.numEvents())
+
+        if chunkSize is None:
+            eventList = list(eventList)
+            chunkSize = self.chooseChunkSize(grouping,numWorkers,numEvents=len(eventList))
+
+        # Reset the running summaries
+        self.numEventsSummed  = 0
+        self.pedestalsMean    = None
+        self.rmsMean          = None
+        self.intrinsicRMSMean = None
+
+        for eventNo,waveLessPed,pedestals,rms,waveLessCoherent,median,intrinsicRMS in \
+                self.processEvents(grouping,eventList,numWorkers,chunkSize,useProcesses):
+            self.updateSummaries(pedestals,rms,intrinsicRMS)
+
+            yield eventNo,waveLessPed,pedestals,rms,waveLessCoherent,median,intrinsicRMS
+
+    # Run the event loop keeping only the regions of interest of each event
+    def iterateROIs(self,grouping,eventList=None,threshold=4.,padding=(10,20),mergeGap=0,bipolar=True,numWorkers=1,chunkSize=None,useProcesses=False):
+        """
+        Generator which filters each event (see iterateEvents) and hands back only its regions of interest, found on
+        the coherent noise subtracted waveforms with the per channel rms (see roiFinder.findROIs for the arguments).
+        The running summaries are kept as in iterateEvents.
+        yields: eventNo,RegionsOfInterest for each non empty event
+        """
+        for eventNo,_,_,rms,waveLessCoherent,_,_ in \
+                self.iterateEvents(grouping,eventList,numWorkers,chunkSize,useProcesses):
+            yield eventNo,findROIs(waveLessCoherent,rms,threshold,padding,mergeGap,bipolar=bipolar)
+
+    def processEvents(self,grouping,eventList,numWorkers=1,chunkSize=4,useProcesses=False):
+        """
+        Filter the events in eventList, optionally spreading the work over a pool of workers. Each worker reads
+        its own chunk of consecutive events through RawDigit.getWaveforms. Results are always handed back in the
+        order of eventList, independent of the number of workers or the order in which the workers finish, so the
+        output is identical to the single worker case. Empty events are dropped. When the instrumentation is enabled
+        the stages recorded in worker processes are merged into this process's instrumentation as each chunk returns
+        """
+        eventList = list(eventList)
+        chunks    = [eventList[idx:idx+chunkSize] for idx in range(0,len(eventList),chunkSize)]
+
+        if numWorkers <= 1:
+            for chunk in chunks:
+                for result in filterEventChunk(self.rawdigits,grouping,chunk):
+                    if result is not None:
+                        yield result
+            return
+
+        # Threads share this process's instrumentation, worker processes send theirs back with each chunk
+        collectStats = useProcesses and instrumentation.enabled
+
+        if useProcesses:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=numWorkers)
+        else:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=numWorkers)
+
+        def submit(chunk):
+            if collectStats:
+                return executor.submit(filterEventChunkInstrumented,self.rawdigits,grouping,chunk,instrumentation.traceMemory)
+            return executor.submit(filterEventChunk,self.rawdigits,grouping,chunk)
 
+        # Keep a bounded number of chunks in flight and always wait on the oldest one to preserve the ordering
+        with executor:
+            pending   = collections.deque()
+            chunkIter = iter(chunks)
+
+            for chunk in chunkIter:
+                pending.append(submit(chunk))
+                if len(pending) >= 2 * numWorkers:
+                    break
+
+            while pending:
+                results = pending.popleft().result()
+                if collectStats:
+                    results,chunkStats = results
+                    instrumentation.merge(chunkStats)
+
+                nextChunk = next(chunkIter,None)
+                if nextChunk is not None:
+                    pending.append(submit(nextChunk))
+
+                for result in results:
+                    if result is not None:
+                        yield result
+
+    def updateSummaries(self,pedestals,rms,intrinsicRMS):
+        """
+        Update the running averages of the per channel pedestals and rms and the per group intrinsic rms with
+        the results of a single event
+        """
+        self.numEventsSummed += 1
 
+        if self.numEventsSummed == 1:
+            self.pedestalsMean    = np.array(pedestals,dtype=float)
+            self.rmsMean          = np.array(rms,dtype=float)
+            self.intrinsicRMSMean = np.array(intrinsicRMS,dtype=float)
+        else:
+            weight                 = 1. / self.numEventsSummed
+            self.pedestalsMean    += weight * (pedestals    - self.pedestalsMean)
+            self.rmsMean          += weight * (rms          - self.rmsMean)
+            self.intrinsicRMSMean += weight * (intrinsicRMS - self.intrinsicRMSMean)
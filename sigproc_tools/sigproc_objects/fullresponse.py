@@ -1,10 +1,14 @@
 # numpy is the source of all life in python
 import numpy as np
-import uproot
-import scipy.signal as signal
+from sigproc_tools.lazyimport import lazyModule
 
 from sigproc_tools.sigproc_objects.fieldresponse import FieldResponse
 from sigproc_tools.sigproc_objects.electronicsresponse import ElectronicsResponse
+from sigproc_tools.sigproc_objects.instrumentation import instrumentation
+
+# scipy is imported on first use
+signal = lazyModule("scipy.signal")
+sfft   = lazyModule("scipy.fft")
 
 
 # An object containing the full response for a given plane in ICARUS
@@ -16,12 +20,15 @@ class FullResponse:
     describing the charge deposition on a wire from a charge deposition in the TPC (typicall a delta function) and then the 
     response due to the TPC electronics. 
     """
-    def __init__(self,responsesFolder,responseFile,normalization=-1.):
+    @instrumentation.timed("FullResponse")
+    def __init__(self,responsesFolder,responseFile,normalization=-1.,*,tickWidth=0.4,numTicks=4096):
         """
         args: responsesFolder is the fully qualified path to the directory containing the response files
               responseFile is tthe name of the file to input
               normalizaation is the normalization to apply to the field response. Note that the electronics 
               response will be normalized to 1, the field responses should be normalized to the collection plane
+              tickWidth is the TPC readout tick width (in us), keyword only
+              numTicks is the number of ticks in the TPC readout waveforms, keyword only
         """
         self.FieldResponse       = FieldResponse(responsesFolder,responseFile,normalization)
         self.ElectronicsResponse = ElectronicsResponse(len(self.FieldResponse.timeBins),self.FieldResponse.binSize)
@@ -34,8 +41,8 @@ class FullResponse:
         # The conversions are:
         # 1) the ratio of bin width in the TPC readout (0.4us) to the field response
         # 2) the number of bins in resmapled output will be the number of bins in the field response divided by the above ratio
-        self.TPCTickWidth = 0.4
-        self.TPCNumTicks  = 4096
+        self.TPCTickWidth = tickWidth
+        self.TPCNumTicks  = numTicks
      
         binTimeRatio      = self.TPCTickWidth / self.FieldResponse.binSize
         binRatio          = int(len(self.FieldResponse.timeBins) / binTimeRatio)
@@ -56,8 +63,114 @@ class FullResponse:
         self.ElecResponseFFT = np.fft.rfft(self.ElecResponse)
 
         # Get the full response T0 offset (returned in us)
-        self.T0Offset = self.FieldResponse.t0Offset + self.ElectronicsResponse.t0Offset
+        self.FieldT0Offset = self.FieldResponse.t0Offset
+        self.ElecT0Offset  = self.ElectronicsResponse.t0Offset
+        self.T0Offset      = self.FieldT0Offset + self.ElecT0Offset
+
+        # Note that the deconvolution of this response is handled by the Deconvolver (see deconvolution.py)
+
+    def getResponse(self,kind="full"):
+        """
+        Returns the response (kind "full" or "electronics") in ticks without the zero padding out to TPCNumTicks
+        """
+        response = self.Response if kind == "full" else self.ElecResponse
+        return np.trim_zeros(response,"b")
+
+    def getT0Ticks(self,kind="full"):
+        """
+        Returns the T0 offset of the response (kind "full" or "electronics") in ticks
+        """
+        t0Offset = self.T0Offset if kind == "full" else self.ElecT0Offset
+        return int(t0Offset/self.TPCTickWidth)
+
+    def getFFTLength(self,numTicks,linear=False):
+        """
+        The FFT length used for waveforms of numTicks ticks. For circular convolution this is just numTicks, for
+        linear convolution the waveform is zero padded to at least numTicks + response length - 1, rounded up to
+        a length which is fast to transform
+        """
+        if not linear:
+            return numTicks
+        return sfft.next_fast_len(numTicks + len(self.getResponse()) - 1,real=True)
+
+    def getResponseFFT(self,numTicks,linear=False,kind="full"):
+        """
+        Returns the rfft of the response (kind "full" or "electronics") matching waveforms of numTicks ticks, see
+        getFFTLength. The spectra are computed on demand and cached per length, the standard (TPCNumTicks, circular)
+        case returns ResponseFFT/ElecResponseFFT themselves
+        """
+        if not linear and numTicks == self.TPCNumTicks:
+            return self.ResponseFFT if kind == "full" else self.ElecResponseFFT
+
+        # Objects restored with loadCache skip __init__, so the spectrum cache is created on first use
+        if not hasattr(self,"spectrumCache"):
+            self.spectrumCache = {}
+
+        key = (kind,numTicks,linear)
+
+        if key not in self.spectrumCache:
+            response = self.getResponse(kind)
+            fftLen   = self.getFFTLength(numTicks,linear)
+
+            # For circular convolution on fewer ticks than the response the response wraps around
+            padded = np.zeros(fftLen)
+            np.add.at(padded,np.arange(len(response)) % fftLen,response)
+
+            self.spectrumCache[key] = sfft.rfft(padded)
+
+        return self.spectrumCache[key]
+
+    def convolve(self,waveforms,kind="full",linear=False,shiftT0=True,workers=None):
+        """
+        Convolve waveforms (...,nTicks), of any length, with the response (kind "full" or "electronics") in a single
+        batched FFT along the last axis.
+        args: linear  - zero pad to avoid wrap around (linear rather than circular convolution)
+              shiftT0 - shift the result back by the T0 offset of the response (as done in genSpikeWaveform)
+              workers - number of threads for scipy.fft (-1 for all cores). scipy caches the FFT plans for each
+                        length so repeated calls with the same lengths do not replan
+        returns: the convolved waveforms with the same shape as the input, float32 input gives float32 output
+        """
+        nTicks   = waveforms.shape[-1]
+        fftLen   = self.getFFTLength(nTicks,linear)
+        spectrum = self.getResponseFFT(nTicks,linear,kind)
+
+        waveformsFFT  = sfft.rfft(waveforms,n=fftLen,axis=-1,workers=workers)
+        waveformsFFT *= spectrum
+        convolved     = sfft.irfft(waveformsFFT,n=fftLen,axis=-1,workers=workers)
+
+        t0Ticks = self.getT0Ticks(kind) if shiftT0 else 0
+
+        if linear:
+            return convolved[...,t0Ticks:t0Ticks+nTicks]
+
+        return np.roll(convolved,-t0Ticks,axis=-1)
+
+    # The arrays which fully describe the response once built, these are what gets saved to disk
+    cachedArrays = ("Response","ResponseFFT","ElecResponse","ElecResponseFFT","T0Offset","FieldT0Offset","ElecT0Offset","TPCTickWidth","TPCNumTicks")
+
+    def saveCache(self,fileName,**extraInfo):
+        """
+        Save the computed response arrays to a numpy .npz file which can be read back with FullResponse.loadCache
+        args: fileName is the file to write
+              extraInfo are any additional values to store alongside (e.g. to identify the source file)
+        """
+        np.savez(fileName,**{name : getattr(self,name) for name in self.cachedArrays},**extraInfo)
+
+    @classmethod
+    def loadCache(cls,fileName):
+        """
+        Build a FullResponse from a file written by saveCache, without reading the field response root file.
+        The FieldResponse and ElectronicsResponse members are not available (set to None) in this case
+        """
+        fullResponse = cls.__new__(cls)
+        fullResponse.FieldResponse       = None
+        fullResponse.ElectronicsResponse = None
+
+        with np.load(fileName) as cacheFile:
+            for name in cls.cachedArrays:
+                value = cacheFile[name]
+                setattr(fullResponse,name,value if value.ndim > 0 else value.item())
 
-        # TODO add in the deconvolution
+        return fullResponse
 
  
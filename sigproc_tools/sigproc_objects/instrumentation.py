@@ -0,0 +1,262 @@
+# Only the standard library here, so anything can be instrumented without extra imports
+import os
+import sys
+import time
+import threading
+import functools
+import tracemalloc
+
+# Timing and memory instrumentation of the processing stages
+#
+# Code to be measured is wrapped in a named stage, either
+#     with instrumentation.stage("coherentNoise") as stage:
+#         ...
+#         stage.add(nBytes=waveforms.nbytes,numEvents=1)
+# or by decorating a function with @instrumentation.timed("coherentNoise"). While the instrumentation is disabled (the
+# default) a stage is a shared do nothing object, so the cost is a single attribute check per call.
+
+class StageStats:
+    """
+    StageStats: the accumulated counters of one stage
+    """
+    def __init__(self):
+        self.calls      = 0
+        self.wallTime   = 0.
+        self.maxTime    = 0.
+        self.nBytes     = 0
+        self.numEvents  = 0
+        self.peakTraced = 0
+
+    def merge(self,other):
+        self.calls      += other.calls
+        self.wallTime   += other.wallTime
+        self.maxTime     = max(self.maxTime,other.maxTime)
+        self.nBytes     += other.nBytes
+        self.numEvents  += other.numEvents
+        self.peakTraced  = max(self.peakTraced,other.peakTraced)
+
+    def summary(self):
+        return {"calls"        : self.calls,
+                "wallTime"     : self.wallTime,
+                "meanTime"     : self.wallTime / max(1,self.calls),
+                "maxTime"      : self.maxTime,
+                "bytes"        : self.nBytes,
+                "events"       : self.numEvents,
+                "MBPerSec"     : self.nBytes / 1.e6 / self.wallTime if self.wallTime > 0. else 0.,
+                "eventsPerSec" : self.numEvents / self.wallTime if self.wallTime > 0. else 0.,
+                "peakTracedMB" : self.peakTraced / 1.e6}
+
+class NullStage:
+    # The stage handed out while the instrumentation is disabled
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*exc):
+        return False
+
+    def add(self,nBytes=0,numEvents=0):
+        pass
+
+class Stage:
+    """
+    Stage: times one pass through a named stage and adds the result to its Instrumentation on exit. When tracing memory
+    the peak is the traced memory allocated on top of what was in use on entry, including that of any nested stages
+    """
+    def __init__(self,instrumentation,name):
+        self.instrumentation = instrumentation
+        self.name            = name
+        self.nBytes          = 0
+        self.numEvents       = 0
+        self.tracing         = instrumentation.traceMemory and tracemalloc.is_tracing()
+
+    def __enter__(self):
+        if self.tracing:
+            self.parents     = self.instrumentation.getStageStack()
+            self.startTraced = tracemalloc.get_traced_memory()[0]
+            self.peakTraced  = self.startTraced
+            self.parents.append(self)
+            if hasattr(tracemalloc,"reset_peak"):
+                tracemalloc.reset_peak()
+        self.startTime = time.perf_counter()
+        return self
+
+    def __exit__(self,*exc):
+        elapsed = time.perf_counter() - self.startTime
+        peak    = 0
+
+        if self.tracing:
+            # Resetting the peak for this stage hides it from the enclosing stage, so hand it up explicitly
+            self.peakTraced = max(self.peakTraced,tracemalloc.get_traced_memory()[1])
+            peak            = self.peakTraced - self.startTraced
+            self.parents.pop()
+            if self.parents:
+                self.parents[-1].peakTraced = max(self.parents[-1].peakTraced,self.peakTraced)
+
+        self.instrumentation.record(self.name,elapsed,self.nBytes,self.numEvents,peak)
+        return False
+
+    def add(self,nBytes=0,numEvents=0):
+        self.nBytes    += nBytes
+        self.numEvents += numEvents
+
+class Instrumentation:
+    """
+    Instrumentation: collects per stage counters (calls, wall time, bytes, events, tracemalloc peak) while enabled.
+    Nested stages are each timed in full, so the time of an outer stage includes that of the stages inside it.
+    A callback, if set, is called as callback(name,elapsed,nBytes,numEvents) at the end of every stage, e.g. to log
+    or send the measurements elsewhere. Counters are kept per process, use merge to combine those of worker processes.
+    """
+    nullStage = NullStage()
+
+    def __init__(self,enabled=False,traceMemory=False,callback=None):
+        self.enabled     = False
+        self.traceMemory = False
+        self.callback    = callback
+        self.stats       = {}
+        self.lock        = threading.Lock()
+        self.local       = threading.local()
+        if enabled:
+            self.enable(traceMemory)
+
+    def enable(self,traceMemory=False):
+        """
+        Start collecting, traceMemory also starts tracemalloc (which slows numpy allocations down noticeably)
+        """
+        self.enabled     = True
+        self.traceMemory = traceMemory
+        if traceMemory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        if self.traceMemory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.enabled     = False
+        self.traceMemory = False
+
+    def reset(self):
+        with self.lock:
+            self.stats = {}
+
+    def stage(self,name):
+        """
+        Returns a context manager timing the enclosed code as stage "name"
+        """
+        if not self.enabled:
+            return self.nullStage
+        return Stage(self,name)
+
+    def timed(self,name=None):
+        """
+        Decorator timing every call of a function as stage "name" (defaults to the function name)
+        """
+        def decorator(func):
+            stageName = name if name is not None else func.__name__
+
+            @functools.wraps(func)
+            def wrapper(*args,**kwargs):
+                if not self.enabled:
+                    return func(*args,**kwargs)
+                with Stage(self,stageName):
+                    return func(*args,**kwargs)
+            return wrapper
+        return decorator
+
+    def getStageStack(self):
+        # The stages currently open in this thread
+        if not hasattr(self.local,"stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def count(self,name,nBytes=0,numEvents=0):
+        """
+        Add to the byte/event counters of a stage without timing anything
+        """
+        if self.enabled:
+            self.record(name,0.,nBytes,numEvents,0,calls=0)
+
+    def record(self,name,elapsed,nBytes,numEvents,peakTraced,calls=1):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = StageStats()
+            stats.calls      += calls
+            stats.wallTime   += elapsed
+            stats.maxTime     = max(stats.maxTime,elapsed)
+            stats.nBytes     += nBytes
+            stats.numEvents  += numEvents
+            stats.peakTraced  = max(stats.peakTraced,peakTraced)
+
+        if self.callback is not None:
+            self.callback(name,elapsed,nBytes,numEvents)
+
+    def merge(self,other):
+        """
+        Add the counters of another Instrumentation (e.g. returned from a worker process), returns self
+        """
+        with self.lock:
+            for name,otherStats in other.stats.items():
+                self.stats.setdefault(name,StageStats()).merge(otherStats)
+        return self
+
+    def report(self):
+        """
+        returns: a dictionary with the summary of each stage and, under "process", the peak resident memory
+        """
+        with self.lock:
+            report = {name : stats.summary() for name,stats in self.stats.items()}
+        report["process"] = {"peakRSSMB" : getPeakRSS() / 1.e6}
+        return report
+
+    def printReport(self,out=None):
+        out    = out if out is not None else sys.stdout
+        report = self.report()
+        print("%-28s %8s %10s %10s %10s %10s %12s" % ("stage","calls","total [s]","mean [ms]","MB/s","events/s","peak [MB]"),file=out)
+        for name,summary in sorted(report.items(),key=lambda item: -item[1].get("wallTime",-1.)):
+            if name == "process":
+                continue
+            print("%-28s %8d %10.3f %10.3f %10.1f %10.1f %12.1f" % (name,summary["calls"],summary["wallTime"],1.e3*summary["meanTime"],
+                                                                   summary["MBPerSec"],summary["eventsPerSec"],summary["peakTracedMB"]),file=out)
+        print("Peak resident memory: %.1f MB" % report["process"]["peakRSSMB"],file=out)
+
+    # Locks and thread local storage can't be pickled, a copy sent to (or back from) another process gets a new one
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["lock"],state["local"]
+        state["callback"] = None
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.lock  = threading.Lock()
+        self.local = threading.local()
+
+def getPeakRSS():
+    """
+    The peak resident memory of this process in bytes (0 where the resource module is not available)
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+def getAvailableMemory():
+    """
+    The memory available for new allocations in bytes, from /proc/meminfo (or sysconf), None if it can't be determined
+    """
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError,OSError,AttributeError):
+        return None
+
+# The instrumentation used throughout sigproc_tools, disabled until instrumentation.enable() is called
+instrumentation = Instrumentation()
@@ -0,0 +1,198 @@
+# numpy is the source of all life in python
+import numpy as np
+
+# Objects to accumulate per channel noise statistics over many events
+
+class RunningMoments:
+    """
+    RunningMoments: running count, mean and variance of an array of quantities (e.g. one per channel) which is
+    updated with one or more events at a time. Batches are combined with the parallel (Chan et al.) form of Welford's
+    algorithm, which is also used to merge accumulators filled in different processes.
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean  = None
+        self.m2    = None
+
+    def update(self,values):
+        """
+        Add a batch of events, values has shape (nEvents,)+shape of the quantity
+        """
+        values = np.asarray(values,dtype=np.float64)
+        if len(values) > 0:
+            batchMean = values.mean(axis=0)
+            self.combine(len(values),batchMean,np.square(values - batchMean).sum(axis=0))
+
+    def combine(self,count,mean,m2):
+        if self.count == 0:
+            self.count,self.mean,self.m2 = count,np.array(mean,dtype=np.float64),np.array(m2,dtype=np.float64)
+            return
+
+        total       = self.count + count
+        delta       = mean - self.mean
+        self.mean   = self.mean + delta * (count / total)
+        self.m2     = self.m2 + m2 + np.square(delta) * (self.count * count / total)
+        self.count  = total
+
+    def merge(self,other):
+        if other.count > 0:
+            self.combine(other.count,other.mean,other.m2)
+        return self
+
+    def getVariance(self,ddof=1):
+        return self.m2 / max(1,self.count - ddof)
+
+    def getSigma(self,ddof=1):
+        return np.sqrt(self.getVariance(ddof))
+
+# The per channel summary returned by NoiseStatistics.getChannelSummary
+channelSummaryType = np.dtype([("channel",      np.int32),
+                               ("numEvents",    np.int64),
+                               ("pedestalMean", np.float32),
+                               ("pedestalSigma",np.float32),
+                               ("rmsMean",      np.float32),
+                               ("rmsSigma",     np.float32),
+                               ("rmsMedian",    np.float32),
+                               ("rmsLow",       np.float32),
+                               ("rmsHigh",      np.float32)])
+
+class NoiseStatistics:
+    """
+    NoiseStatistics: run level per channel noise summaries built one event at a time from the outputs of
+    getPedestalsAndRMS/removeCoherentNoise (or FilterEvents.iterateEvents), without storing any per event arrays:
+          pedestals    - running mean and variance per channel
+          rms          - running mean and variance per channel, plus a histogram per channel for medians/quantiles
+          intrinsicRMS - running mean and variance per group of the tick averaged intrinsic rms, and the running mean
+                         per group and tick (as FilterEvents.intrinsicRMSMean)
+    Accumulators filled in different processes can be combined with merge.
+    """
+    def __init__(self,rmsRange=(0.,20.),rmsBins=400):
+        """
+        args: rmsRange, rmsBins - the binning of the per channel rms histograms, values outside the range are
+                                  counted in under/overflow bins. The bin width sets the precision of the quantiles
+        """
+        self.rmsRange        = rmsRange
+        self.rmsBins         = rmsBins
+        self.pedestals       = RunningMoments()
+        self.rms             = RunningMoments()
+        self.intrinsicRMS    = RunningMoments()
+        self.intrinsicRMSSum = None
+        self.rmsHistograms   = None
+
+    def numEvents(self):
+        return self.pedestals.count
+
+    def update(self,pedestals,rms,intrinsicRMS=None):
+        """
+        Add a single event: the per channel pedestals and rms and optionally the per group intrinsic rms of shape
+        (nGroups,nTicks)
+        """
+        self.updateBatch(np.asarray(pedestals)[None],np.asarray(rms)[None],
+                         np.asarray(intrinsicRMS)[None] if intrinsicRMS is not None else None)
+
+    def updateBatch(self,pedestals,rms,intrinsicRMS=None):
+        """
+        Add a batch of events, e.g. the pedestalsAll, rmsAll and intrinsicRMSAll arrays of FilterEvents.filterEvents
+        """
+        pedestals = np.asarray(pedestals,dtype=np.float64)
+        rms       = np.asarray(rms,dtype=np.float64)
+
+        self.pedestals.update(pedestals)
+        self.rms.update(rms)
+        self.fillHistograms(rms)
+
+        if intrinsicRMS is not None:
+            intrinsicRMS = np.asarray(intrinsicRMS,dtype=np.float64)
+            self.intrinsicRMS.update(intrinsicRMS.mean(axis=-1))
+            if self.intrinsicRMSSum is None:
+                self.intrinsicRMSSum  = intrinsicRMS.sum(axis=0)
+            else:
+                self.intrinsicRMSSum += intrinsicRMS.sum(axis=0)
+
+    def fillHistograms(self,rms):
+        nChannels = rms.shape[-1]
+        nBins     = self.rmsBins + 2
+
+        if self.rmsHistograms is None:
+            self.rmsHistograms = np.zeros((nChannels,nBins),dtype=np.int64)
+
+        # Bin 0 is the underflow and bin rmsBins+1 the overflow, one bincount fills every channel at once
+        low,high  = self.rmsRange
+        bins      = np.floor((rms - low) * (self.rmsBins / (high - low))).astype(np.int64) + 1
+        bins      = np.clip(bins,0,nBins-1) + np.arange(nChannels) * nBins
+        self.rmsHistograms += np.bincount(bins.ravel(),minlength=nChannels*nBins).reshape(nChannels,nBins)
+
+    def addFilterEvents(self,filterEvents,grouping,eventList=None,**kwargs):
+        """
+        Run FilterEvents.iterateEvents over eventList (default all) and add every event, extra arguments are passed
+        on to iterateEvents (e.g. numWorkers)
+        """
+        for _,_,pedestals,rms,_,_,intrinsicRMS in filterEvents.iterateEvents(grouping,eventList,**kwargs):
+            self.update(pedestals,rms,intrinsicRMS)
+
+    def merge(self,other):
+        """
+        Add the statistics of another accumulator (e.g. filled in a worker process) to this one, returns self
+        """
+        if other.rmsRange != self.rmsRange or other.rmsBins != self.rmsBins:
+            raise ValueError("Can only merge noise statistics with the same rms binning")
+
+        self.pedestals.merge(other.pedestals)
+        self.rms.merge(other.rms)
+        self.intrinsicRMS.merge(other.intrinsicRMS)
+
+        if other.rmsHistograms is not None:
+            self.rmsHistograms = other.rmsHistograms.copy() if self.rmsHistograms is None else self.rmsHistograms + other.rmsHistograms
+        if other.intrinsicRMSSum is not None:
+            self.intrinsicRMSSum = other.intrinsicRMSSum.copy() if self.intrinsicRMSSum is None else self.intrinsicRMSSum + other.intrinsicRMSSum
+
+        return self
+
+    def getRMSQuantiles(self,quantiles):
+        """
+        returns: the requested quantiles of the rms of each channel over events, shape (nChannels,)+shape(quantiles),
+                 interpolated within the histogram bins (under/overflows are put at the edges of the range)
+        """
+        quantiles  = np.asarray(quantiles,dtype=np.float64)
+        low,high   = self.rmsRange
+        binWidth   = (high - low) / self.rmsBins
+        cumulative = np.cumsum(self.rmsHistograms,axis=1) / np.maximum(1,self.rmsHistograms.sum(axis=1))[:,None]
+
+        # Bin i (of the histogram including the underflow) covers [low+(i-1)*binWidth,low+i*binWidth)
+        results = np.empty((len(cumulative),)+quantiles.shape)
+        for idx,quantile in np.ndenumerate(quantiles):
+            binIdx   = np.argmax(cumulative >= quantile,axis=1)
+            rows     = np.arange(len(cumulative))
+            below    = np.where(binIdx > 0,cumulative[rows,binIdx-1],0.)
+            fraction = (quantile - below) / np.maximum(cumulative[rows,binIdx] - below,1.e-12)
+            values   = low + (binIdx - 1 + fraction) * binWidth
+            results[(slice(None),)+idx] = np.clip(values,low,high)
+
+        return results
+
+    def getIntrinsicRMSMean(self):
+        """
+        returns: the intrinsic rms per group and tick averaged over events
+        """
+        return self.intrinsicRMSSum / max(1,self.intrinsicRMS.count)
+
+    def getChannelSummary(self,lowQuantile=0.05,highQuantile=0.95):
+        """
+        returns: a structured array (channelSummaryType) with one entry per channel: the mean and sigma of the pedestal
+                 and rms over events and the median and low/high quantiles of the rms
+        """
+        nChannels = len(self.pedestals.mean)
+        summary   = np.zeros(nChannels,dtype=channelSummaryType)
+        medians,lows,highs = self.getRMSQuantiles([0.5,lowQuantile,highQuantile]).T
+
+        summary["channel"]       = np.arange(nChannels)
+        summary["numEvents"]     = self.pedestals.count
+        summary["pedestalMean"]  = self.pedestals.mean
+        summary["pedestalSigma"] = self.pedestals.getSigma()
+        summary["rmsMean"]       = self.rms.mean
+        summary["rmsSigma"]      = self.rms.getSigma()
+        summary["rmsMedian"]     = medians
+        summary["rmsLow"]        = lows
+        summary["rmsHigh"]       = highs
+
+        return summary
@@ -0,0 +1,143 @@
+# numpy is the source of all life in python
+import numpy as np
+from sigproc_tools.lazyimport import lazyModule
+
+# scipy is imported on first use
+signal = lazyModule("scipy.signal")
+
+# An object to accumulate average noise power spectra over many events
+
+class PowerSpectrumAccumulator:
+    """
+    PowerSpectrumAccumulator: keeps running sums of the power spectra of waveforms which are handed to it one event
+    (or chunk of events) at a time, so noise spectra can be built over a full run in constant memory. Spectra are
+    kept separately for each "stage" of the processing, e.g. "raw", "pedestal" (pedestal subtracted) and "coherent"
+    (coherent noise subtracted), or any other name such as "median" for the group medians. Each stage holds one
+    spectrum per row (channel) of the waveforms, averaged spectra per group of channels are formed on request.
+
+    The spectra are computed with scipy's Welch method in float32. By default each waveform is a single segment with
+    no window, which is the periodogram returned by noiseAnalysis.getPowerVec. Accumulators filled in different
+    processes can be combined with merge.
+    """
+    def __init__(self,maxFrequency=2.5,grouping=64,segmentLength=None,window=None,dtype=np.float32):
+        """
+        args: maxFrequency  - the sampling frequency in MHz (1/tickWidth), as passed to getPowerVec
+              grouping      - the number of consecutive channels averaged in the group spectra
+              segmentLength - the Welch segment length in ticks (half overlapping), None for the full waveform
+              window        - the Welch window, defaults to "boxcar" for full waveforms and "hann" for segments
+              dtype         - the type the spectra are computed and accumulated in
+        """
+        self.maxFrequency  = maxFrequency
+        self.grouping      = grouping
+        self.segmentLength = segmentLength
+        self.window        = window if window is not None else ("boxcar" if segmentLength is None else "hann")
+        self.dtype         = np.dtype(dtype)
+        self.freqVec       = None
+        self.powerSums     = {}
+        self.numEvents     = {}
+
+    def computeSpectra(self,waveforms):
+        """
+        The (mean subtracted) power spectrum of each waveform, the last dimension being ticks
+        """
+        waveforms = np.asarray(waveforms).astype(self.dtype,copy=False)
+        freqVec,powerVec = signal.welch(waveforms,self.maxFrequency,window=self.window,detrend="constant",axis=-1,
+                                        nperseg=self.segmentLength if self.segmentLength is not None else waveforms.shape[-1])
+        if self.freqVec is None:
+            self.freqVec = freqVec
+        return powerVec.astype(self.dtype,copy=False)
+
+    def addEvent(self,waveforms,stage="raw"):
+        """
+        Add the spectra of one event, waveforms of shape (nChannels,nTicks), to the given stage
+        """
+        self.addEvents(np.asarray(waveforms)[None],stage)
+
+    def addEvents(self,waveforms,stage="raw"):
+        """
+        Add the spectra of a chunk of events, waveforms of shape (nEvents,nChannels,nTicks), to the given stage
+        """
+        powerVec = self.computeSpectra(waveforms).sum(axis=0)
+
+        if stage in self.powerSums:
+            self.powerSums[stage] += powerVec
+            self.numEvents[stage] += len(waveforms)
+        else:
+            self.powerSums[stage]  = powerVec
+            self.numEvents[stage]  = len(waveforms)
+
+    def addRawDigits(self,rawdigits,eventList=None,stage="raw"):
+        """
+        Add the raw waveforms of the events in eventList (default all) of a RawDigit or RawDigitStore
+        """
+        if eventList is None:
+            eventList = range(rawdigits.numEvents())
+
+        for eventNo in eventList:
+            if rawdigits.numChannels(eventNo) > 0:
+                self.addEvent(rawdigits.getWaveforms(eventNo),stage)
+
+    def addFilterEvents(self,filterEvents,grouping,eventList=None,stages=("raw","pedestal","coherent"),**kwargs):
+        """
+        Run FilterEvents.iterateEvents over eventList (default all) and add each event to the requested stages,
+        "raw", "pedestal", "coherent" and/or "median" (the group medians). Extra arguments are passed on to
+        iterateEvents (e.g. numWorkers)
+        """
+        rawdigits = filterEvents.getRawDigits()
+
+        for eventNo,waveLessPed,_,_,waveLessCoherent,median,_ in filterEvents.iterateEvents(grouping,eventList,**kwargs):
+            if "raw" in stages:
+                self.addEvent(rawdigits.getWaveforms(eventNo),"raw")
+            if "pedestal" in stages:
+                self.addEvent(waveLessPed,"pedestal")
+            if "coherent" in stages:
+                self.addEvent(waveLessCoherent,"coherent")
+            if "median" in stages:
+                self.addEvent(median,"median")
+
+    def merge(self,other):
+        """
+        Add the sums of another accumulator (e.g. filled in a worker process) to this one, returns self
+        """
+        if other.maxFrequency != self.maxFrequency or other.segmentLength != self.segmentLength or other.window != self.window:
+            raise ValueError("Can only merge power spectra computed with the same frequency, segment length and window")
+
+        if self.freqVec is None:
+            self.freqVec = other.freqVec
+
+        for stage,powerSum in other.powerSums.items():
+            if stage in self.powerSums:
+                self.powerSums[stage] += powerSum
+                self.numEvents[stage] += other.numEvents[stage]
+            else:
+                self.powerSums[stage]  = powerSum.copy()
+                self.numEvents[stage]  = other.numEvents[stage]
+
+        return self
+
+    def getStages(self):
+        return list(self.powerSums.keys())
+
+    def getSpectra(self,stage="raw"):
+        """
+        returns: freqVec and the per channel power spectra of the stage averaged over events, (nChannels,nFrequencies)
+        """
+        return self.freqVec,self.powerSums[stage] / self.numEvents[stage]
+
+    def getGroupSpectra(self,stage="raw",grouping=None):
+        """
+        returns: freqVec and the power spectra of the stage averaged over events and over the channels in each group,
+                 (nGroups,nFrequencies). A partial last group averages the remaining channels
+        """
+        grouping       = grouping if grouping is not None else self.grouping
+        freqVec,powers = self.getSpectra(stage)
+        firstChannels  = np.arange(0,len(powers),grouping)
+        groupSizes     = np.diff(np.append(firstChannels,len(powers)))
+        return freqVec,np.add.reduceat(powers,firstChannels,axis=0) / groupSizes[:,None].astype(self.dtype)
+
+    def getMeanSpectrum(self,stage="raw"):
+        """
+        returns: freqVec and the power spectrum of the stage averaged over events and all channels
+        """
+        freqVec,powers = self.getSpectra(stage)
+        return freqVec,powers.mean(axis=0)
@@ -1,54 +1,157 @@
 # numpy is the source of all life in python
 import numpy as np
+import collections
+import threading
+from sigproc_tools.sigproc_objects.instrumentation import instrumentation
 
 # An object for handling RawDigits from art root files
 
 class RawDigit:
     """
-    RawDigit: Emulates RawDigits as read into python via "uproot". Generally this means that we are given the 
-    "events" folder in the input root file which contains the RawDigits per event. We can then access each by 
-    event number 
+    RawDigit: Emulates RawDigits as read into python via "uproot". Generally this means that we are given the
+    "events" folder in the input root file which contains the RawDigits per event. We can then access each by
+    event number
+
+    Reads are done in chunks of "chunkSize" consecutive events, pulling the fADC, fSamples and fChannel branches
+    for the whole chunk in one call per branch. The decoded chunks are kept in a least recently used cache limited
+    to "cacheMemory" bytes so that looping over events (sequentially or in random order) decompresses each basket
+    only once, no matter how many of the accessors below are called for a given event.
     """
-    def __init__(self,eventsFolder,producer):
+    def __init__(self,eventsFolder,producer,chunkSize=1,cacheMemory=512*1024*1024):
         """
         args: eventsFolder is the folder containing the desired RawDigits by event
               producer is the path to the RawDigits for uproot to decode when looking them up
+              chunkSize is the number of consecutive events to read from the file in one go
+              cacheMemory is the maximum number of bytes of decoded events to keep in the cache
         """
         self.eventsFolder = eventsFolder
         self.producer     = producer
         self.obj          = eventsFolder.array(self.producer+"obj",flatten=True)
-        
+        self.chunkSize    = max(1,int(chunkSize))
+        self.cacheMemory  = cacheMemory
+        self.cache        = collections.OrderedDict()
+        self.cacheBytes   = 0
+        self.cacheLock    = threading.Lock()
+
+    # Locks can't be pickled, when shipped to another process we start with a fresh cache
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["cacheLock"]
+        state["cache"]      = collections.OrderedDict()
+        state["cacheBytes"] = 0
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.cacheLock = threading.Lock()
+
     def numEvents(self):
         numEvents = len(self.obj)
         return numEvents
-        
+
     def numChannels(self,eventNum):
         nChannels = self.obj[eventNum]
         return nChannels
-    
+
     def numTicks(self,eventNum,channelNum=0):
-        samples = self.eventsFolder.array(self.producer+"obj.fSamples",entrystart=eventNum,entrystop=eventNum+1,flatten=True)
+        samples,_,_ = self.getEventData(eventNum)
         return samples[channelNum]
-    
-    def getWaveforms(self,eventNum):
+
+    def getWaveforms(self,eventNum,dtype=None,out=None):
         """
         Plan: Provided the RawDigits exists for a given event (e.g. in Multi-TPC readout an event may have no RawDigits),
-              we can look up the information to pull out the waveform from the data block. Interestingly, each waveform 
+              we can look up the information to pull out the waveform from the data block. Interestingly, each waveform
               will begin with a count (4096) and end with a guard (0) - except there is no count for the first and no guard
-              for the last. So the below contortions are done to allow resizing and dropping of this extraneous info
+              for the last. Rather than padding and copying the block we step over these words with a strided view.
+        args: eventNum is the event to return
+              dtype, if given, returns a contiguous (nChannels,nTicks) copy of this type (e.g. np.int16, the native ADC
+              width, or np.float32)
+              out, if given, is a preallocated (nChannels,nTicks) buffer which is filled and returned, it can be reused
+              from event to event to avoid any allocation
+        returns: by default a read only (nChannels,nTicks) view of the cached data, no copy is made
         """
         # First check to see if this event has an entry (can happen in multiTPC readout)
-        if self.numChannels(eventNum) > 0:
-            nTicks    = self.numTicks(eventNum)
-            nChannels = self.numChannels(eventNum)
-            waveforms = self.eventsFolder.array(self.producer+"obj.fADC",entrystart=eventNum,entrystop=eventNum+1,flatten=True)
-            waveforms = np.concatenate([waveforms,[0,nTicks]])  # This adds the pattern "0, 4096" to the end of the 1D array
-            waveforms = waveforms.reshape(nChannels,nTicks+2)   # Now we make a 2D array of 384 channels by 4096+2 ticks
-            return waveforms[:,:-2]
+        nChannels = self.numChannels(eventNum)
+        if nChannels > 0:
+            samples,waveforms,_ = self.getEventData(eventNum)
+            nTicks    = int(samples[0])
+            if len(waveforms) == nChannels * nTicks:
+                # A multi event read may already have dropped the count and guard words
+                waveforms = waveforms.reshape(nChannels,nTicks)
+                waveforms.flags.writeable = False
+            else:
+                # Each row starts nTicks+2 words after the previous one, the last row has no trailing words
+                itemSize  = waveforms.itemsize
+                waveforms = np.lib.stride_tricks.as_strided(waveforms,shape=(nChannels,nTicks),
+                                                            strides=((nTicks+2)*itemSize,itemSize),writeable=False)
         else:
-            return numpy.zeros(shape=(1,1))
-        
+            waveforms = np.zeros(shape=(1,1))
+
+        if out is not None:
+            np.copyto(out,waveforms,casting="unsafe")
+            return out
+
+        if dtype is not None:
+            return np.ascontiguousarray(waveforms,dtype=dtype)
+
+        return waveforms
+
     def getChannels(self,eventNum):
-        channels = self.eventsFolder.array(self.producer+"obj.fChannel",entrystart=eventNum,entrystop=eventNum+1,flatten=True)
+        _,_,channels = self.getEventData(eventNum)
         return channels
 
+    def getEventData(self,eventNum):
+        """
+        Returns the flattened (fSamples, fADC, fChannel) arrays for the given event, reading the chunk of events
+        containing it from the file if it is not already in the cache
+        """
+        chunkIdx = eventNum // self.chunkSize
+
+        with self.cacheLock:
+            if chunkIdx in self.cache:
+                self.cache.move_to_end(chunkIdx)
+            else:
+                with instrumentation.stage("readRawDigits") as stage:
+                    chunk      = self.readChunk(chunkIdx)
+                    chunkBytes = sum(array.nbytes for event in chunk for array in event)
+                    stage.add(chunkBytes,len(chunk))
+
+                # Make room for the new chunk, but always keep at least the chunk we are about to use
+                while self.cache and self.cacheBytes + chunkBytes > self.cacheMemory:
+                    _,oldChunk       = self.cache.popitem(last=False)
+                    self.cacheBytes -= sum(array.nbytes for event in oldChunk for array in event)
+
+                self.cache[chunkIdx] = chunk
+                self.cacheBytes     += chunkBytes
+
+            return self.cache[chunkIdx][eventNum - chunkIdx * self.chunkSize]
+
+    def readChunk(self,chunkIdx):
+        """
+        Bulk read of the fSamples, fADC and fChannel branches for the chunkIdx'th chunk of events
+        returns a list with a (fSamples, fADC, fChannel) tuple of flat numpy arrays per event
+        """
+        entryStart = chunkIdx * self.chunkSize
+        entryStop  = min(entryStart + self.chunkSize,self.numEvents())
+
+        # A chunk of one event is read exactly as the file lays it out, flattened
+        if entryStop - entryStart == 1:
+            return [tuple(np.asarray(self.eventsFolder.array(self.producer+branch,entrystart=entryStart,entrystop=entryStop,flatten=True))
+                          for branch in ("obj.fSamples","obj.fADC","obj.fChannel"))]
+
+        samples  = self.eventsFolder.array(self.producer+"obj.fSamples",entrystart=entryStart,entrystop=entryStop)
+        adc      = self.eventsFolder.array(self.producer+"obj.fADC",    entrystart=entryStart,entrystop=entryStop)
+        channels = self.eventsFolder.array(self.producer+"obj.fChannel",entrystart=entryStart,entrystop=entryStop)
+
+        return [(flattenEntry(samples[idx]),flattenEntry(adc[idx]),flattenEntry(channels[idx])) for idx in range(entryStop-entryStart)]
+
+    def clearCache(self):
+        with self.cacheLock:
+            self.cache.clear()
+            self.cacheBytes = 0
+
+# The per event entries of a multi event read can be (nested) jagged arrays, reduce them to a flat numpy array
+def flattenEntry(entry):
+    if hasattr(entry,"flatten"):
+        entry = entry.flatten()
+    return np.asarray(entry)
@@ -0,0 +1,154 @@
+# numpy is the source of all life in python
+import numpy as np
+import json
+import os
+
+# A converted, memory mapped copy of the RawDigits in an art root file
+#
+# The store is a folder containing:
+#     waveforms.npy - dense int16 array of shape (numEvents, maxChannels, maxTicks)
+#     channels.npy  - the channel map, int array of shape (numEvents, maxChannels)
+#     numChannels.npy, numTicks.npy - the number of channels and ticks actually filled for each event
+#     metadata.json - producer and shape information
+
+def convertRawDigits(rawdigits,storeFolder,eventList=None,dtype=np.int16):
+    """
+    One time conversion of the RawDigits accessed through a RawDigit object into an on disk store which can then be
+    read back with RawDigitStore, without any decompression
+    args: rawdigits   - the RawDigit object to convert
+          storeFolder - the folder to write the store into (created if needed)
+          eventList   - optional list of events to convert, defaults to all events in the file
+          dtype       - the type to store the ADC values as, int16 is the native ADC width
+    returns: a RawDigitStore opened on the new store
+    """
+    if eventList is None:
+        eventList = range(rawdigits.numEvents())
+
+    eventList   = list(eventList)
+    numEvents   = len(eventList)
+    numChannels = np.array([rawdigits.numChannels(eventNum) for eventNum in eventList],dtype=np.int64)
+    numTicks    = np.array([rawdigits.numTicks(eventNum) if numChannels[idx] > 0 else 0 for idx,eventNum in enumerate(eventList)],dtype=np.int64)
+    maxChannels = int(numChannels.max()) if numEvents > 0 else 0
+    maxTicks    = int(numTicks.max())    if numEvents > 0 else 0
+
+    print("Converting",numEvents,"events with up to",maxChannels,"channels and",maxTicks,"ticks to",storeFolder)
+
+    os.makedirs(storeFolder,exist_ok=True)
+
+    waveforms = np.lib.format.open_memmap(os.path.join(storeFolder,"waveforms.npy"),mode="w+",dtype=dtype,shape=(numEvents,maxChannels,maxTicks))
+    channels  = np.lib.format.open_memmap(os.path.join(storeFolder,"channels.npy"), mode="w+",dtype=np.int64,shape=(numEvents,maxChannels))
+
+    for idx,eventNum in enumerate(eventList):
+        nChannels = numChannels[idx]
+        nTicks    = numTicks[idx]
+
+        if nChannels > 0:
+            rawdigits.getWaveforms(eventNum,out=waveforms[idx,:nChannels,:nTicks])
+            channels[idx,:nChannels] = rawdigits.getChannels(eventNum)
+
+        if idx%10 == 0:
+            print("--> Done with event ",idx)
+
+    waveforms.flush()
+    channels.flush()
+    del waveforms,channels
+
+    np.save(os.path.join(storeFolder,"numChannels.npy"),numChannels)
+    np.save(os.path.join(storeFolder,"numTicks.npy"),   numTicks)
+    np.save(os.path.join(storeFolder,"eventNums.npy"),  np.array(eventList,dtype=np.int64))
+
+    metadata = {"producer"    : getattr(rawdigits,"producer",""),
+                "numEvents"   : numEvents,
+                "maxChannels" : maxChannels,
+                "maxTicks"    : maxTicks,
+                "dtype"       : np.dtype(dtype).str}
+
+    with open(os.path.join(storeFolder,"metadata.json"),"w") as metadataFile:
+        json.dump(metadata,metadataFile,indent=2)
+
+    return RawDigitStore(storeFolder)
+
+# An object giving RawDigit style access to a converted store
+
+class RawDigitStore:
+    """
+    RawDigitStore: provides the same interface as RawDigit (numEvents, numChannels, numTicks, getWaveforms, getChannels)
+    over a store written by convertRawDigits. The waveforms are memory mapped so opening the store is essentially free
+    and any event, channel or tick range can be sliced directly with no decoding. It can be handed to FilterEvents in
+    place of the uproot events folder and, since it only holds the folder name, pickles cheaply for process pools.
+    """
+    def __init__(self,storeFolder):
+        """
+        args: storeFolder is the folder written by convertRawDigits
+        """
+        self.storeFolder = storeFolder
+
+        with open(os.path.join(storeFolder,"metadata.json")) as metadataFile:
+            self.metadata = json.load(metadataFile)
+
+        self.producer        = self.metadata["producer"]
+        self.numChannelsVec  = np.load(os.path.join(storeFolder,"numChannels.npy"))
+        self.numTicksVec     = np.load(os.path.join(storeFolder,"numTicks.npy"))
+        self.eventNums       = np.load(os.path.join(storeFolder,"eventNums.npy"))
+        self.openArrays()
+
+    def openArrays(self):
+        self.waveforms = np.load(os.path.join(self.storeFolder,"waveforms.npy"),mmap_mode="r")
+        self.channels  = np.load(os.path.join(self.storeFolder,"channels.npy"), mmap_mode="r")
+
+    # Memory maps are reopened rather than pickled
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["waveforms"],state["channels"]
+        return state
+
+    def __setstate__(self,state):
+        self.__dict__.update(state)
+        self.openArrays()
+
+    def numEvents(self):
+        return len(self.numChannelsVec)
+
+    def numChannels(self,eventNum):
+        return self.numChannelsVec[eventNum]
+
+    def numTicks(self,eventNum,channelNum=0):
+        return self.numTicksVec[eventNum]
+
+    def getWaveforms(self,eventNum,dtype=None,out=None,channelRange=None,tickRange=None):
+        """
+        Returns the waveforms for the given event, see RawDigit.getWaveforms for dtype and out
+        args: channelRange and tickRange are optional (first,last+1) ranges to restrict the returned block to
+        returns: by default a read only memory mapped view of the (nChannels,nTicks) block, no data is copied
+        """
+        nChannels = self.numChannels(eventNum)
+        nTicks    = self.numTicks(eventNum)
+
+        if nChannels > 0:
+            channelSlice = slice(*channelRange) if channelRange is not None else slice(0,nChannels)
+            tickSlice    = slice(*tickRange)    if tickRange    is not None else slice(0,nTicks)
+            waveforms    = self.waveforms[eventNum,:nChannels,:nTicks][channelSlice,tickSlice]
+        else:
+            waveforms = np.zeros(shape=(1,1))
+
+        if out is not None:
+            np.copyto(out,waveforms,casting="unsafe")
+            return out
+
+        if dtype is not None:
+            return np.ascontiguousarray(waveforms,dtype=dtype)
+
+        return waveforms
+
+    def getWaveformBlock(self,eventRange=None,channelRange=None,tickRange=None):
+        """
+        Returns a memory mapped (events,channels,ticks) view of the dense store, each range is an optional
+        (first,last+1) tuple. Note that events with fewer channels or ticks than the maximum are zero padded
+        """
+        eventSlice   = slice(*eventRange)   if eventRange   is not None else slice(None)
+        channelSlice = slice(*channelRange) if channelRange is not None else slice(None)
+        tickSlice    = slice(*tickRange)    if tickRange    is not None else slice(None)
+        return self.waveforms[eventSlice,channelSlice,tickSlice]
+
+    def getChannels(self,eventNum):
+        return self.channels[eventNum,:self.numChannels(eventNum)]
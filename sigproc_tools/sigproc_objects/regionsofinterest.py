@@ -0,0 +1,93 @@
+# numpy is the source of all life in python
+import numpy as np
+
+# A compact container for the regions of interest found in one event
+
+class RegionsOfInterest:
+    """
+    RegionsOfInterest: a run length encoded (sparse) copy of a set of waveforms keeping only the regions of interest.
+    Each ROI is a channel, a start tick and the samples from that tick on. Everything is held in flat numpy arrays:
+          channels   - the channel (row) index of each ROI
+          startTicks - the first tick of each ROI
+          offsets    - ROI i has samples[offsets[i]:offsets[i+1]], so there are numROIs()+1 offsets
+          samples    - all the samples of all the ROIs, back to back
+    ROIs are ordered by channel then start tick. The dense shape (numChannels,numTicks) is kept so the waveforms can
+    be rebuilt (zero outside the ROIs) with toDense.
+    """
+    def __init__(self,channels,startTicks,offsets,samples,numChannels,numTicks):
+        self.channels    = np.asarray(channels,dtype=np.int32)
+        self.startTicks  = np.asarray(startTicks,dtype=np.int32)
+        self.offsets     = np.asarray(offsets,dtype=np.int64)
+        self.samples     = np.asarray(samples)
+        self.numChannels = int(numChannels)
+        self.numTicks    = int(numTicks)
+
+    def numROIs(self):
+        return len(self.channels)
+
+    def getLengths(self):
+        return np.diff(self.offsets)
+
+    def getEndTicks(self):
+        # one past the last tick of each ROI
+        return self.startTicks + self.getLengths()
+
+    def getROI(self,roiIdx):
+        """
+        returns: channel, startTick and a view of the samples of the roiIdx'th ROI
+        """
+        return self.channels[roiIdx],self.startTicks[roiIdx],self.samples[self.offsets[roiIdx]:self.offsets[roiIdx+1]]
+
+    def getChannelROIs(self,channel):
+        """
+        returns: a list of (startTick,samples) for the ROIs on the given channel
+        """
+        first = np.searchsorted(self.channels,channel,side="left")
+        last  = np.searchsorted(self.channels,channel,side="right")
+        return [self.getROI(roiIdx)[1:] for roiIdx in range(first,last)]
+
+    def getTickIndices(self):
+        """
+        returns: the channel and tick of every entry in samples, e.g. for scatter plots or np.add.at
+        """
+        lengths  = self.getLengths()
+        channels = np.repeat(self.channels,lengths)
+        ticks    = np.repeat(self.startTicks - self.offsets[:-1],lengths) + np.arange(len(self.samples))
+        return channels,ticks
+
+    def toDense(self,dtype=None,out=None):
+        """
+        Rebuild the (numChannels,numTicks) waveforms, zero outside the ROIs
+        args: dtype - the type of the output, defaults to that of the samples
+              out   - optional preallocated buffer to fill
+        """
+        if out is None:
+            out = np.zeros((self.numChannels,self.numTicks),dtype=dtype if dtype is not None else self.samples.dtype)
+        else:
+            out[...] = 0
+
+        channels,ticks     = self.getTickIndices()
+        out[channels,ticks] = self.samples
+        return out
+
+    def occupancy(self):
+        """
+        returns: the fraction of the dense waveforms kept in the ROIs
+        """
+        return len(self.samples) / max(1,self.numChannels * self.numTicks)
+
+    def nbytes(self):
+        return self.channels.nbytes + self.startTicks.nbytes + self.offsets.nbytes + self.samples.nbytes
+
+    def save(self,fileName,**extraInfo):
+        """
+        Save the ROIs to a .npz file, extraInfo (e.g. eventNo) is stored alongside
+        """
+        np.savez(fileName,channels=self.channels,startTicks=self.startTicks,offsets=self.offsets,samples=self.samples,
+                 shape=np.array([self.numChannels,self.numTicks]),**extraInfo)
+
+    @classmethod
+    def load(cls,fileName):
+        with np.load(fileName) as roiFile:
+            numChannels,numTicks = roiFile["shape"]
+            return cls(roiFile["channels"],roiFile["startTicks"],roiFile["offsets"],roiFile["samples"],numChannels,numTicks)
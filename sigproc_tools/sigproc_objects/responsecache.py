@@ -0,0 +1,75 @@
+# numpy is the source of all life in python
+import numpy as np
+import hashlib
+import os
+
+from sigproc_tools.sigproc_objects.fullresponse import FullResponse
+
+# A registry of FullResponse objects so the (fairly expensive) response construction is only done once
+#
+# Responses are memoized in process, keyed by (response file, normalization, tick width, number of ticks),
+# and can optionally also be kept in an on disk cache of .npz files so that later runs and worker processes
+# can load them directly without opening the root file
+
+fullResponseRegistry = {}
+
+def getFullResponse(responsesFolder,responseFile,normalization=-1.,tickWidth=0.4,numTicks=4096,cacheFolder=None):
+    """
+    Return the FullResponse for the given parameters, building it only if it is neither in the in process
+    registry nor (if cacheFolder is given) in the on disk cache
+    args: responsesFolder,responseFile,normalization,tickWidth,numTicks - as for FullResponse
+          cacheFolder - optional folder for the .npz disk cache (created if needed)
+    """
+    sourceFile = responsesFolder + responseFile
+    key        = (sourceFile,float(normalization),float(tickWidth),int(numTicks))
+
+    if key in fullResponseRegistry:
+        return fullResponseRegistry[key]
+
+    fullResponse = None
+
+    if cacheFolder is not None:
+        cacheFile = os.path.join(cacheFolder,cacheFileName(key))
+
+        if os.path.exists(cacheFile) and cacheIsCurrent(cacheFile,sourceFile):
+            fullResponse = FullResponse.loadCache(cacheFile)
+
+    if fullResponse is None:
+        fullResponse = FullResponse(responsesFolder,responseFile,normalization,tickWidth=tickWidth,numTicks=numTicks)
+
+        if cacheFolder is not None:
+            os.makedirs(cacheFolder,exist_ok=True)
+            fullResponse.saveCache(cacheFile,sourceStamp=sourceStamp(sourceFile))
+
+    fullResponseRegistry[key] = fullResponse
+
+    return fullResponse
+
+def clearResponseRegistry():
+    """
+    Empty the in process registry (the disk cache is left untouched)
+    """
+    fullResponseRegistry.clear()
+
+def cacheFileName(key):
+    # A readable prefix plus a hash of the full key so different parameters never collide
+    sourceFile = key[0]
+    prefix     = os.path.splitext(os.path.basename(sourceFile))[0]
+    keyHash    = hashlib.sha1(repr(key).encode()).hexdigest()[:16]
+    return prefix + "_" + keyHash + ".npz"
+
+def sourceStamp(sourceFile):
+    # The size and modification time of the response file, used to spot stale cache files
+    if not os.path.exists(sourceFile):
+        return np.array([-1.,-1.])
+    fileStat = os.stat(sourceFile)
+    return np.array([float(fileStat.st_size),fileStat.st_mtime])
+
+def cacheIsCurrent(cacheFile,sourceFile):
+    # If the source file is not available (e.g. on a worker node) the cached response is trusted
+    if not os.path.exists(sourceFile):
+        return True
+    with np.load(cacheFile) as cached:
+        if "sourceStamp" not in cached:
+            return False
+        return np.array_equal(cached["sourceStamp"],sourceStamp(sourceFile))